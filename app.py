@@ -1,64 +1,391 @@
 import streamlit as st
 st.set_page_config(page_title="App kiểm tra học viên khóa ISO 50001", layout="wide")
 
-import pandas as pd, gspread, hashlib, time, os, re
+import gspread, requests, hashlib, hmac, time, os, re, sys, json, sqlite3, threading, random, logging
+import importlib, contextlib, collections, functools, io
+from collections import namedtuple, Counter
 from datetime import datetime
+from types import MappingProxyType
 from google.oauth2.service_account import Credentials
-import plotly.express as px
-from PIL import Image, UnidentifiedImageError
+import reports
+
+_T0 = time.perf_counter()
+log = logging.getLogger("testform")
+if not log.handlers:
+    _h = logging.StreamHandler()
+    _h.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log.addHandler(_h); log.setLevel(os.environ.get("APP_LOG_LEVEL", "INFO"))
+
+class LazyModule:
+    """Module nặng (pandas, numpy) chỉ import thật ở lần dùng thuộc tính đầu tiên,
+    nên trang đăng nhập hiển thị mà không phải chờ import."""
+    def __init__(self, name): self._name = name
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+pd = LazyModule("pandas")
+np = LazyModule("numpy")
+pa = LazyModule("pyarrow")
+pq = LazyModule("pyarrow.parquet")
+
+# ------------ Đo thời gian (bật bằng APP_PROFILE=1 hoặc ở sidebar admin) ------------
+_NOOP = contextlib.nullcontext()
+
+class Profiler:
+    """Đo span có tên và đếm cache hit/miss cho cả tiến trình.
+
+    Mỗi rerun (luồng script của 1 phiên) giữ danh sách span riêng để xem chi
+    tiết; span ở luồng nền chỉ cộng vào tổng. Khi tắt, `span()` trả về 1
+    context rỗng dùng chung và `hit/miss/count` thoát ngay."""
+    def __init__(self, on=False, keep=50):
+        self.on, self.lock, self.local = on, threading.Lock(), threading.local()
+        self.totals = {}                 # span -> [lượt, tổng giây, max giây]
+        self.counters = Counter()        # ("cache_hit", tên) / ("cache_miss", tên) / ("reruns", trang)...
+        self.recent = collections.deque(maxlen=keep)
+        self.prom_t = 0.0
+
+    def span(self, name): return _Span(self, name) if self.on else _NOOP
+
+    def _add(self, name, dt):
+        with self.lock:
+            t = self.totals.setdefault(name, [0, 0.0, 0.0])
+            t[0] += 1; t[1] += dt; t[2] = max(t[2], dt)
+
+    def count(self, kind, name, n=1):
+        if self.on:
+            with self.lock: self.counters[(kind, name)] += n
+    def hit(self, name):  self.count("cache_hit", name)
+    def miss(self, name): self.count("cache_miss", name)
+
+    def begin(self):
+        if self.on: self.local.spans, self.local.depth, self.local.t0 = [], 0, time.perf_counter()
+
+    def end(self, page):
+        """Kết thúc rerun: lưu vào danh sách gần đây, ghi log JSON và file Prometheus (nếu cấu hình)."""
+        spans = getattr(self.local, "spans", None)
+        if not self.on or spans is None: return
+        self.local.spans = None
+        rec = {"ts": datetime.now().isoformat(timespec="milliseconds"), "page": page, "ms": round((time.perf_counter()-self.local.t0)*1000, 2),
+               "spans": [(n, round((dt or 0)*1000, 2), d) for n, dt, d in spans]}
+        self.recent.append(rec); self.count("reruns", page)
+        self._add(f"rerun.{page}", rec["ms"]/1000)
+        if plog.handlers: plog.info(json.dumps({"event": "rerun", **rec}, ensure_ascii=False))
+        if PROM_FILE and time.monotonic()-self.prom_t > 15:
+            self.prom_t = time.monotonic()
+            tmp = f"{PROM_FILE}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f: f.write(self.prometheus())
+            os.replace(tmp, PROM_FILE)
+
+    def last(self):
+        """(ms từ đầu rerun, span [tên, giây|None nếu chưa xong, độ sâu]) của rerun đang chạy."""
+        t0 = getattr(self.local, "t0", None)
+        return ((time.perf_counter()-t0)*1000 if t0 else 0.0,
+                [tuple(x) for x in getattr(self.local, "spans", None) or []])
+
+    def table(self):
+        with self.lock:
+            return [{"span": n, "lượt": c, "tổng (ms)": round(s*1000, 1),
+                     "TB (ms)": round(s*1000/c, 2), "max (ms)": round(m*1000, 1)}
+                    for n, (c, s, m) in sorted(self.totals.items(), key=lambda x: -x[1][1])]
+
+    def caches(self):
+        with self.lock: c = dict(self.counters)
+        names = sorted({n for k, n in c if k in ("cache_hit", "cache_miss")})
+        return [{"cache": n, "hit": c.get(("cache_hit", n), 0), "miss": c.get(("cache_miss", n), 0)}
+                for n in names]
+
+    def prometheus(self):
+        """Bộ đếm dạng text exposition của Prometheus (dùng với node_exporter textfile)."""
+        with self.lock: totals, counters = dict(self.totals), dict(self.counters)
+        out = ["# TYPE testform_span_seconds_total counter", "# TYPE testform_span_calls_total counter"]
+        for n, (c, s, _) in sorted(totals.items()):
+            out += [f'testform_span_seconds_total{{span="{n}"}} {s:.6f}',
+                    f'testform_span_calls_total{{span="{n}"}} {c}']
+        for kind in sorted({k for k, _ in counters}):
+            out.append(f"# TYPE testform_{kind}_total counter")
+            label = "page" if kind == "reruns" else "cache" if kind.startswith("cache") else "name"
+            out += [f'testform_{kind}_total{{{label}="{n}"}} {v}'
+                    for (k, n), v in sorted(counters.items()) if k == kind]
+        return "\n".join(out) + "\n"
+
+    def reset(self):
+        with self.lock: self.totals.clear(); self.counters.clear(); self.recent.clear()
+
+class _Span:
+    __slots__ = ("p", "name", "t0", "depth", "rec")
+    def __init__(self, p, name): self.p, self.name = p, name
+    def __enter__(self):
+        loc = self.p.local; self.depth = getattr(loc, "depth", 0); loc.depth = self.depth+1
+        spans, self.rec = getattr(loc, "spans", None), None
+        if spans is not None: self.rec = [self.name, None, self.depth]; spans.append(self.rec)
+        self.t0 = time.perf_counter()
+    def __exit__(self, *exc):
+        dt = time.perf_counter()-self.t0
+        self.p._add(self.name, dt); self.p.local.depth = self.depth
+        if self.rec: self.rec[1] = dt
+
+def profiled(name=None):
+    """Decorator: đo cả hàm như 1 span."""
+    def deco(fn):
+        key = name or fn.__name__
+        @functools.wraps(fn)
+        def run(*a, **k):
+            if not prof.on: return fn(*a, **k)
+            with prof.span(key): return fn(*a, **k)
+        return run
+    return deco
+
+def probed(name, cache):
+    """Bọc 1 hàm @st.cache_*: thân hàm chỉ chạy khi cache miss, nên đếm được hit/miss."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def body(*a, **k):
+            prof.miss(name); prof.count("cache_hit", name, -1)
+            with prof.span(f"load.{name}"): return fn(*a, **k)
+        cached = cache(body)
+        @functools.wraps(fn)
+        def call(*a, **k):
+            prof.hit(name); return cached(*a, **k)
+        call.clear = cached.clear
+        return call
+    return deco
+
+PROM_FILE = os.environ.get("APP_PROM_FILE", "")
+plog = logging.getLogger("testform.profile")
+plog.propagate = False   # chỉ ghi ra file APP_PROFILE_LOG, không lẫn vào log stderr của "testform"
+if os.environ.get("APP_PROFILE_LOG") and not plog.handlers:
+    _h = logging.FileHandler(os.environ["APP_PROFILE_LOG"], encoding="utf-8")
+    _h.setFormatter(logging.Formatter("%(message)s")); plog.addHandler(_h)
+
+# Script chạy lại từ đầu mỗi rerun nên bộ đo phải sống trong cache của tiến trình
+@st.cache_resource
+def _profiler(): return Profiler(os.environ.get("APP_PROFILE", "") not in ("", "0"))
+prof = _profiler()
 
 # ------------ Cấu hình logo 2×3 cm ~ 76×113 px ------------
 LOGO_WIDTH, LOGO_HEIGHT = 150, 150
 SUPPORTED_FORMATS = ("png", "jpg", "jpeg", "gif")
 
+LOGO_DEFAULTS = ("logo1.PNG", "logo2.PNG", "logo3.PNG")
+LOGO_HERE = os.path.dirname(os.path.abspath(__file__))
+
+class LogoSet:
+    """3 logo đã xử lý sẵn (PNG 150×150), dùng chung cho mọi phiên.
+    Ảnh được lưu theo mã băm nội dung trong DATA_DIR/logos nên chỉ giải mã và
+    thu nhỏ một lần; logo kèm theo ứng dụng là mặc định, admin có thể thay ở tab Bảo trì."""
+    def __init__(self, root):
+        self.root = root; self.conf = os.path.join(root, "current.json")
+        self.lock = threading.Lock(); self.mtime = None; self.imgs = [None]*3
+
+    def _process(self, data):
+        key = hashlib.sha256(data + f"{LOGO_WIDTH}x{LOGO_HEIGHT}".encode()).hexdigest()[:32]
+        path = os.path.join(self.root, key + ".png")
+        if not os.path.exists(path):
+            from PIL import Image
+            buf = io.BytesIO()
+            Image.open(io.BytesIO(data)).resize((LOGO_WIDTH, LOGO_HEIGHT)).save(buf, "PNG", optimize=True)
+            os.makedirs(self.root, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f: f.write(buf.getvalue())
+            os.replace(tmp, path)
+        return key
+
+    def _keys(self):
+        try:
+            with open(self.conf) as f: return json.load(f)
+        except (OSError, ValueError): return [None]*3
+
+    def get(self):
+        """Danh sách bytes PNG; chỉ đọc lại khi current.json đổi (admin ở tiến trình khác thay logo)."""
+        try: m = os.stat(self.conf).st_mtime_ns
+        except OSError: m = 0
+        if m == self.mtime: return self.imgs
+        with self.lock:
+            if m != self.mtime:
+                keys, imgs = self._keys(), []
+                for i, name in enumerate(LOGO_DEFAULTS):
+                    k = keys[i] if i < len(keys) else None
+                    try:
+                        if k is None:
+                            with open(os.path.join(LOGO_HERE, name), "rb") as f: k = self._process(f.read())
+                        with open(os.path.join(self.root, k + ".png"), "rb") as f: imgs.append(f.read())
+                    except Exception as e:
+                        log.warning("Không đọc được logo %d: %s", i + 1, e); imgs.append(None)
+                self.imgs, self.mtime = imgs, m
+        return self.imgs
+
+    def save(self, uploads):
+        """uploads: 3 phần tử bytes hoặc None (giữ nguyên); uploads=None → về logo mặc định."""
+        keys = [None]*3 if uploads is None else [
+            self._process(d) if d else k for d, k in zip(uploads, (self._keys() + [None]*3)[:3])]
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self.conf}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f: json.dump(keys, f)
+        os.replace(tmp, self.conf); self.mtime = None
+
+@st.cache_resource
+def logos(): return LogoSet(os.path.join(DATA_DIR, "logos"))
+
+@profiled("logos")
 def display_logos():
-    """Cho phép tải lên 03 logo và hiển thị chúng trên giao diện."""
+    """Hiển thị 03 logo đã xử lý sẵn trên giao diện."""
     st.title("TUV NORD ONSITE APP")
-    placeholder = st.empty()  # Khung để chứa uploader
-
-    # Sử dụng placeholder để tạo uploader cho 03 file
-    with placeholder.container():
-        col1, col2, col3, col4, col5 = st.columns(5)
-        uploaded_files = []
-        uploaded_files.append(col1.file_uploader("Logo 1", type=SUPPORTED_FORMATS, key="file1"))
-        uploaded_files.append(col3.file_uploader("Logo 2", type=SUPPORTED_FORMATS, key="file2"))
-        uploaded_files.append(col5.file_uploader("Logo 3", type=SUPPORTED_FORMATS, key="file3"))
-
-    # Kiểm tra nếu cả 03 logo đã được tải lên
-    if all(uploaded_files):
-        try:
-            cols = st.columns(3)  # Tạo các cột để hiển thị logo
-            for i, uploaded_file in enumerate(uploaded_files):
-                # Mở và kiểm tra logo
-                img = Image.open(uploaded_file).resize((LOGO_WIDTH, LOGO_HEIGHT))
-                cols[i].image(img, caption=f"Logo {i + 1}")
-
-            # Ẩn uploader sau khi hoàn thành
-            placeholder.empty()
-            st.success("All logos uploaded successfully!")
-        
-        except Exception as e:
-            st.error(f"An error occurred: {e}")
+    cols = st.columns(3)
+    for i, img in enumerate(logos().get()):
+        if img: cols[i].image(img, caption=f"Logo {i + 1}")
 
-    else:
-        st.warning("Please upload all 03 logos.")
+def logo_admin():
+    """Thay 03 logo (tab Bảo trì của admin)."""
+    with st.form("logo_form", clear_on_submit=True):
+        c = st.columns(3)
+        ups = [c[i].file_uploader(f"Logo {i + 1}", type=SUPPORTED_FORMATS, key=f"file{i + 1}") for i in range(3)]
+        c1, c2 = st.columns(2)
+        ok, reset = c1.form_submit_button("Cập nhật logo"), c2.form_submit_button("Khôi phục logo mặc định")
+    if ok:
+        if not any(ups): st.warning("Chưa chọn logo nào.")
+        else:
+            try:
+                logos().save([u.getvalue() if u else None for u in ups]); st.success("Đã cập nhật logo.")
+            except Exception as e:
+                st.error(f"An error occurred: {e}")
+    if reset:
+        logos().save(None); st.success("Đã khôi phục logo mặc định.")
 
 
 # ------------ Thiết lập Google Sheets ------------
 SCOPE = ["https://www.googleapis.com/auth/spreadsheets",
          "https://www.googleapis.com/auth/drive"]
 
-def retry(func, tries=5, delay=1, mult=2):
-    for i in range(tries):
+SHEETS_READS_PM  = int(os.environ.get("APP_SHEETS_READS", 60))    # quota đọc/phút/người dùng
+SHEETS_WRITES_PM = int(os.environ.get("APP_SHEETS_WRITES", 60))   # quota ghi/phút/người dùng
+SHEETS_BURST = 10
+SHEETS_TRIES = 6
+SHEETS_WRITE_OPS = {
+    "append_row", "append_rows", "update", "update_cell", "update_acell", "update_cells",
+    "batch_update", "batch_clear", "clear", "resize", "update_title", "format",
+    "insert_row", "insert_rows", "insert_cols", "delete_rows", "delete_columns",
+    "values_update", "values_append", "values_clear", "values_batch_update",
+    "add_worksheet", "del_worksheet", "duplicate_sheet", "create", "del_spreadsheet", "share",
+}
+RETRY_CODES = {429, 500, 502, 503, 504}
+
+class TokenBucket:
+    """Giới hạn tốc độ gọi API: `rate` lượt/giây, dồn tối đa `cap` lượt."""
+    def __init__(self, rate, cap):
+        self.rate, self.cap = rate, cap
+        self.tokens, self.t = float(cap), time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, n=1):
+        """Lấy n lượt, chờ nếu hết; trả về số giây đã chờ."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.cap, self.tokens+(now-self.t)*self.rate)
+                self.t = now
+                if self.tokens >= n:
+                    self.tokens -= n; return waited
+                wait = (n-self.tokens)/self.rate
+            time.sleep(wait); waited += wait
+
+class SheetsMetrics:
+    """Số lượt gọi, độ trễ và số lần bị giới hạn theo từng thao tác ("Questions.get_all_values")."""
+    def __init__(self):
+        self.lock, self.ops = threading.Lock(), {}
+
+    def add(self, op, **kw):
+        with self.lock: self.ops.setdefault(op, Counter()).update(kw)
+
+    def rows(self):
+        with self.lock:
+            return [{"thao tác": op, "lượt gọi": m["calls"], "gộp": m["coalesced"],
+                     "thử lại": m["retries"], "bị 429": m["throttled"], "lỗi": m["errors"],
+                     "chờ quota (s)": round(m["wait"], 2),
+                     "TB (ms)": round(1000*m["time"]/m["calls"], 1) if m["calls"] else 0.0}
+                    for op, m in sorted(self.ops.items())]
+
+class _Flight:
+    def __init__(self): self.done, self.value, self.exc = threading.Event(), None, None
+
+def _share(v):
+    """Bản sao nông (list of lists) để các phiên dùng chung một kết quả đọc mà không sửa lẫn nhau."""
+    return [list(r) if isinstance(r, list) else r for r in v] if isinstance(v, list) else v
+
+class SheetsGate:
+    """Cửa chung cho mọi lệnh gọi Google Sheets của tiến trình:
+    - lấy lượt từ token bucket đọc/ghi trước khi gọi (không đợi bị 429 mới chậm lại),
+    - gộp các lệnh đọc giống hệt nhau đang chạy đồng thời thành 1 request,
+    - thử lại 429/5xx/lỗi mạng với backoff ngẫu nhiên (full jitter),
+    - ghi số liệu theo từng thao tác vào `metrics`."""
+    def __init__(self, reads=SHEETS_READS_PM, writes=SHEETS_WRITES_PM):
+        self.buckets = {False: TokenBucket(reads/60, SHEETS_BURST),
+                        True:  TokenBucket(writes/60, SHEETS_BURST)}
+        self.metrics, self.lock, self.flights = SheetsMetrics(), threading.Lock(), {}
+
+    def wrap(self, v):
+        if isinstance(v, (gspread.Spreadsheet, gspread.Worksheet)): return QuotaSheets(v, self)
+        if isinstance(v, list) and v and isinstance(v[0], gspread.Worksheet):
+            return [QuotaSheets(x, self) for x in v]
+        return v
+
+    def call(self, op, write, key, fn):
+        if write: return self._call(op, write, fn)
+        with self.lock:
+            f = self.flights.get(key); lead = f is None
+            if lead: f = self.flights[key] = _Flight()
+        if not lead:
+            self.metrics.add(op, coalesced=1); f.done.wait()
+            if f.exc is not None: raise f.exc
+            return _share(f.value)
         try:
-            return func()
-        except gspread.exceptions.APIError as e:
-            if "429" in str(e) and i < tries-1:
-                st.warning(f"Giới hạn tốc độ, thử lại sau {delay}s…")
-                time.sleep(delay)
-                delay *= mult
-            else:
-                raise
+            v = self._call(op, write, fn); f.value = _share(v)
+            return v
+        except Exception as e:
+            f.exc = e; raise
+        finally:
+            with self.lock: del self.flights[key]
+            f.done.set()
+
+    def _call(self, op, write, fn):
+        t0, wait = time.perf_counter(), 0.0
+        try:
+            for i in range(SHEETS_TRIES):
+                wait += self.buckets[write].take()
+                try:
+                    with prof.span("api." + op): return fn()
+                except (gspread.exceptions.APIError, requests.ConnectionError, requests.Timeout) as e:
+                    code = getattr(e, "code", None)
+                    if code == 429: self.metrics.add(op, throttled=1)
+                    if (code is not None and code not in RETRY_CODES) or i == SHEETS_TRIES-1:
+                        self.metrics.add(op, errors=1); raise
+                    delay = random.uniform(0, min(32, 2**i))
+                    log.warning("%s lỗi %s, thử lại sau %.1fs", op, code or type(e).__name__, delay)
+                    self.metrics.add(op, retries=1); time.sleep(delay)
+                except Exception:
+                    self.metrics.add(op, errors=1); raise
+        finally:
+            self.metrics.add(op, calls=1, wait=wait, time=time.perf_counter()-t0-wait)
+
+class QuotaSheets:
+    """Bọc client/spreadsheet/worksheet gspread: mọi phương thức đi qua SheetsGate,
+    kết quả là spreadsheet/worksheet cũng được bọc. Thuộc tính thường (title, id,
+    col_count...) trả thẳng từ đối tượng gốc."""
+    def __init__(self, target, gate):
+        self._t, self.gate = target, gate
+        self._label = getattr(target, "title", None) or type(target).__name__
+
+    def __getattr__(self, name):
+        v = getattr(self._t, name)
+        if name.startswith("_") or not callable(v): return v
+        op, write, t = f"{self._label}.{name}", name in SHEETS_WRITE_OPS, self._t
+        def call(*a, **kw):
+            key = None if write else (op, getattr(t, "spreadsheet_id", None), getattr(t, "id", None),
+                                      repr(a), repr(sorted(kw.items())))
+            return self.gate.call(op, write, key, lambda: self.gate.wrap(v(*a, **kw)))
+        return call
+
+    def __repr__(self): return f"QuotaSheets({self._t!r})"
 
 @st.cache_resource
 def gclient():
@@ -68,18 +395,27 @@ def gclient():
         creds = Credentials.from_service_account_info(
             st.secrets["gcp_service_account"], scopes=SCOPE
         )
-    return gspread.authorize(creds)
+    return QuotaSheets(gspread.authorize(creds), SheetsGate())
+
+USERS_HDR = ["company","full_name","email","position","department",
+             "gender","password","confirm_password"]
+ADMIN_HDR = ["username","password"]
+QUES_HDR  = ["question id","question text","options","correct answers","points"]
+RSP_HDR   = ["email","question id","selected answers","is correct",
+             "score","timestamp","edit no"]   # dùng chung cho Responses và Answers
 
 def ensure_header(ws, header):
-    cur = [c.lower() for c in ws.row_values(1)]
+    cur = [c.lower() for c in ws.row_values(1)][:len(header)]
     tgt = [h.lower() for h in header]
     if cur != tgt:
-        ws.resize(rows=max(ws.row_count,1), cols=len(header))
+        ws.resize(rows=max(ws.row_count,1), cols=max(ws.col_count,len(header)))
         ws.update(f"A1:{chr(64+len(header))}1", [header])
 
-@st.cache_resource(ttl=3600)
-def gws():
-    cli = gclient()
+def setup_sheets(cli):
+    """Tạo workbook/worksheet còn thiếu, chuẩn hóa header và tạo tài khoản mặc định.
+
+    Chạy 1 lần bằng `python app.py setup`; app cũng tự gọi khi mở một sheet bị
+    thiếu hoặc khi chưa có mật khẩu Admin."""
     # Users_DB
     try: udb = cli.open("Users_DB")
     except gspread.exceptions.SpreadsheetNotFound:
@@ -88,19 +424,16 @@ def gws():
         udb.add_worksheet("Users", rows=100, cols=10)
     users_ws = udb.worksheet("Users")
     admin_ws = udb.worksheet("Admin")
-    ensure_header(users_ws, [
-        "company","full_name","email","position","department",
-        "gender","password","confirm_password"
-    ])
-    ensure_header(admin_ws, ["username","password"])
-    if len(admin_ws.get_all_values()) == 1:
+    ensure_header(users_ws, USERS_HDR)
+    ensure_header(admin_ws, ADMIN_HDR)
+    if not admin_ws.row_values(2):
         admin_ws.append_row([
             "admin",
-            hashlib.sha256("admin123".encode()).hexdigest()
+            hash_pw("admin123")
         ])
     # Default user nếu cần
-    if len(users_ws.get_all_values()) == 1:
-        pw0 = hashlib.sha256("user123".encode()).hexdigest()
+    if not users_ws.row_values(2):
+        pw0 = hash_pw("user123")
         users_ws.append_row([
             "Công ty mặc định","Người dùng","user@example.com",
             "Học sinh","CNTT","Nam",pw0,pw0
@@ -111,17 +444,13 @@ def gws():
         ques_ws = quiz_wb.worksheet("Questions")
     except gspread.exceptions.SpreadsheetNotFound:
         quiz_wb = cli.create("Quiz_Questions")
-        ques_ws = quiz_wb.sheet1
+        ques_ws = quiz_wb.get_worksheet(0)
         ques_ws.update_title("Questions")
-        ensure_header(ques_ws, [
-            "question id","question text","options","correct answers","points"
-        ])
+        ensure_header(ques_ws, QUES_HDR)
     except gspread.exceptions.WorksheetNotFound:
         quiz_wb = cli.open("Quiz_Questions")
         ques_ws = quiz_wb.add_worksheet("Questions", rows=1, cols=5)
-        ensure_header(ques_ws, [
-            "question id","question text","options","correct answers","points"
-        ])
+        ensure_header(ques_ws, QUES_HDR)
     # Quiz_Responses
     try: rsp_wb = cli.open("Quiz_Responses")
     except gspread.exceptions.SpreadsheetNotFound:
@@ -129,44 +458,1282 @@ def gws():
         rsp_wb.add_worksheet("Responses", rows=1, cols=10)
     try: rsp_ws = rsp_wb.worksheet("Responses")
     except gspread.exceptions.WorksheetNotFound:
-        rsp_ws = rsp_wb.sheet1
+        rsp_ws = rsp_wb.get_worksheet(0)
         rsp_ws.update_title("Responses")
-    ensure_header(rsp_ws, [
-        "email","question id","selected answers","is correct",
-        "score","timestamp","edit no"
-    ])
-    return {
-        "users": users_ws,
-        "admin": admin_ws,
-        "ques": ques_ws,
-        "rsp_wb": rsp_wb,
-        "rsp_ws": rsp_ws
+    ensure_header(rsp_ws, RSP_HDR)
+    # Trạng thái trả lời mới nhất theo (email, question id)
+    try: ans_ws = rsp_wb.worksheet("Answers")
+    except gspread.exceptions.WorksheetNotFound:
+        ans_ws = rsp_wb.add_worksheet("Answers", rows=1, cols=len(RSP_HDR))
+    ensure_header(ans_ws, RSP_HDR)
+    # Nâng cấp từ bản cũ: Answers còn trống nhưng có sheet riêng theo học viên -> gộp vào
+    # (không xóa sheet cũ), nếu không số lần nộp của mọi học viên bị đặt lại về 0
+    if not ans_ws.row_values(2) and any(ws.title not in ("Responses","Answers") for ws in rsp_wb.worksheets()):
+        n, skipped = SheetsStorage(LazySheets(lambda: cli)).migrate_user_sheets()
+        log.info("Đã gộp %d sheet học viên vào Answers", n)
+        if skipped: log.warning("Không xác định được email của: %s", ", ".join(skipped))
+    log.info("Đã kiểm tra/khởi tạo cấu trúc Google Sheets")
+
+class LazySheets(dict):
+    """Handle worksheet theo tên ("users", "ques", ...), chỉ mở ở lần truy cập đầu.
+
+    Client gspread cũng chỉ được tạo (đọc credentials) khi cần mở sheet đầu tiên."""
+    SPEC = {
+        "users":  ("Users_DB",       "Users"),
+        "admin":  ("Users_DB",       "Admin"),
+        "ques":   ("Quiz_Questions", "Questions"),
+        "rsp_wb": ("Quiz_Responses", None),
+        "rsp_ws": ("Quiz_Responses", "Responses"),
+        "ans_ws": ("Quiz_Responses", "Answers"),
     }
 
+    def __init__(self, client):
+        super().__init__()
+        self.client, self._cli = client, None
+        self.books, self.lock = {}, threading.RLock()
+
+    @property
+    def cli(self):
+        with self.lock:
+            if self._cli is None: self._cli = self.client()
+            return self._cli
+
+    def _open(self, key):
+        book, title = self.SPEC[key]
+        if book not in self.books:
+            self.books[book] = self.cli.open(book)
+        return self.books[book] if title is None else \
+            self.books[book].worksheet(title)
+
+    def __missing__(self, key):
+        with self.lock:
+            if dict.__contains__(self, key): return dict.__getitem__(self, key)
+            try:
+                v = self._open(key)
+            except (gspread.exceptions.SpreadsheetNotFound,
+                    gspread.exceptions.WorksheetNotFound):
+                setup_sheets(self.cli); self.books.clear()
+                v = self._open(key)
+            self[key] = v
+            return v
+
+@st.cache_resource
+def gws():
+    return LazySheets(gclient)
+
+# ------------ Lớp lưu trữ ------------
+DATA_DIR = os.environ.get("APP_DATA_DIR", "data")
+STORAGE  = os.environ.get("APP_STORAGE", "sheets")   # "sheets" | "sqlite"
+
+class Storage:
+    """Giao diện lưu trữ chung cho người dùng, admin, câu hỏi, phản hồi và
+    trạng thái trả lời của từng học viên.
+
+    Bảng trả về là DataFrame chuỗi với tên cột viết thường như header sheet;
+    dòng trả lời của học viên có dạng [timestamp, qid, selected, is_correct, score];
+    số lần nộp (`edits`) lưu kèm trên từng dòng trả lời. Mọi thao tác ghi câu hỏi
+    đều đổi tem phiên bản câu hỏi (`ques_version`)."""
+    remote = False   # True nếu mỗi lệnh tốn quota API
+
+    def users(self):                          raise NotImplementedError
+    def add_user(self, row):                  raise NotImplementedError
+    def set_user_pw(self, email, hashed):     raise NotImplementedError
+    def admin_pw(self):                       raise NotImplementedError
+    def set_admin_pw(self, hashed):           raise NotImplementedError
+    def questions(self):                      raise NotImplementedError
+    def ques_version(self):                   raise NotImplementedError
+    def bump_ques_version(self):              raise NotImplementedError
+    def add_question(self, row):              raise NotImplementedError
+    def update_question(self, qid, row):      raise NotImplementedError
+    def renumber_questions(self, mapping):    raise NotImplementedError   # trả về mapping đã áp dụng
+    def upsert_questions(self, rows):         raise NotImplementedError
+    def responses(self):                      raise NotImplementedError
+    def responses_since(self, mark, limit=None): raise NotImplementedError
+    def append_responses(self, rows):         raise NotImplementedError
+    def drop_responses(self, mark):           raise NotImplementedError
+    def user_state(self, email):              raise NotImplementedError
+    def save_user_states(self, states):       raise NotImplementedError   # {email: (dòng, edits)}
+    def regrade(self, qb):                    raise NotImplementedError
+
+RENUMBER = "renumber:"   # tiền tố ô phiên bản câu hỏi khi đang đánh lại id
+
+class SheetsStorage(Storage):
+    """Lưu trên Google Sheets; trạng thái trả lời nằm chung trong sheet Answers."""
+    remote = True
+
+    def __init__(self, handles):
+        self.h = handles
+        self.lock = threading.RLock()
+        self.idx = None
+
+    def users(self):     return _df(self.h["users"])
+    def add_user(self, row):
+        self.h["users"].append_row(row)
+    def set_user_pw(self, email, hashed):
+        ws = self.h["users"]
+        ridx = ws.find(email, in_column=3).row
+        ws.update(f"G{ridx}:H{ridx}", [[hashed, hashed]])
+
+    def admin_pw(self):
+        v = self.h["admin"].cell(2,2).value
+        if not v and isinstance(self.h, LazySheets):
+            setup_sheets(self.h.cli); v = self.h["admin"].cell(2,2).value
+        return v or ""
+    def set_admin_pw(self, hashed):
+        self.h["admin"].update("B2", [[hashed]])
+
+    # Tem phiên bản câu hỏi nằm ở ô Z1 của sheet Questions
+    def questions(self): return _df(self.h["ques"], len(QUES_HDR))
+    def ques_version(self):
+        return self.h["ques"].acell("Z1").value or ""
+    def bump_ques_version(self, upd=(), tag=None):
+        ws = self.h["ques"]
+        if ws.col_count < 26: ws.resize(cols=26)
+        ws.batch_update([*upd, {"range":"Z1", "values":[[tag or stamp()]]}])
+    def add_question(self, row):
+        self.h["ques"].append_row(row)
+        self.bump_ques_version()
+    def update_question(self, qid, row):
+        ws = self.h["ques"]
+        ridx = ws.find(str(qid), in_column=1).row
+        self.bump_ques_version([{"range":f"A{ridx}:E{ridx}", "values":[row]}])
+    def upsert_questions(self, rows):
+        """Ghi đè câu có id đã tồn tại, thêm câu mới: 1 lần đọc cột A, 1 append_rows
+        cho các câu mới và 1 batch_update cho các câu sửa kèm tem phiên bản."""
+        ws = self.h["ques"]
+        at = {v.strip(): i for i, v in enumerate(ws.col_values(1)[1:], 2) if v.strip()}
+        upd = [{"range":f"A{at[r[0]]}:E{at[r[0]]}", "values":[r]} for r in rows if r[0] in at]
+        new = [r for r in rows if r[0] not in at]
+        if new: ws.append_rows(new, value_input_option="RAW")
+        self.bump_ques_version(upd)
+    def renumber_questions(self, mapping):
+        """Đánh lại id {cũ: mới}; dừng giữa chừng thì lần gọi sau làm tiếp, không đổi 2 lần.
+
+        B1: ghi mapping kèm mã lần đổi vào ô phiên bản Z1 của Questions.
+        B2: sửa cột question id của Responses và Answers cùng ô Answers!Z1 = mã
+        lần đổi trong 1 batch (cả workbook, nguyên tử). B3: ghi cột A của Questions
+        cùng tem phiên bản mới (xóa dấu). Nếu Z1 còn dấu RENUMBER thì dùng lại
+        mapping đã lưu, bỏ qua B2 khi Answers!Z1 đã mang mã đó. Chỉ đổi khi cột id
+        hiện tại đúng bằng các khóa của mapping (mapping có thể tính từ ngân hàng cũ,
+        vd. phiên admin khác vừa đánh lại); nếu không thì trả về {} và không ghi gì."""
+        ques, wb, ans = self.h["ques"], self.h["rsp_wb"], self.h["ans_ws"]
+        with self.lock:
+            ids = ques.col_values(1)[1:]
+            have = sorted(int(v) for v in ids if v.strip().isdigit())
+            cur = self.ques_version()
+            if cur.startswith(RENUMBER):
+                tok, m = json.loads(cur[len(RENUMBER):])
+                stored = {int(o):n for o,n in m.items()}
+                if sorted(stored) == have: mapping = stored   # làm tiếp lần đổi dở dang
+                else: cur = ""                                # dấu cũ không còn khớp cột id
+            if not cur.startswith(RENUMBER):
+                if sorted(mapping) != have: return {}
+                tok = stamp()
+                self.bump_ques_version(tag=RENUMBER+json.dumps([tok, mapping]))
+            if (ans.acell("Z1").value or "") != tok:
+                data = []
+                for ws in (self.h["rsp_ws"], ans):
+                    ref = ws.col_values(2)[1:]
+                    out = [[remap_qid(v, mapping)] for v in ref]
+                    if out != [[v] for v in ref]:
+                        data.append({"range":f"'{ws.title}'!B2:B{len(ref)+1}", "values":out})
+                if ans.col_count < 26: ans.resize(cols=26)
+                data.append({"range":f"'{ans.title}'!Z1", "values":[[tok]]})
+                wb.values_batch_update({"valueInputOption":"RAW", "data":data})
+            self.idx = None
+            new = [[str(mapping.get(int(v), v)) if v.strip().isdigit() else v] for v in ids]
+            self.bump_ques_version([{"range":f"A2:A{len(ids)+1}", "values":new}] if ids else [])
+        return mapping
+
+    def responses(self): return _df(self.h["rsp_ws"])
+    def responses_since(self, mark, limit=None):
+        """Các dòng Responses sau `mark` dòng dữ liệu đầu (đọc theo vùng, tối đa `limit` dòng);
+        trả về (dòng, mark mới)."""
+        mark = mark or 0
+        try:
+            vals = self.h["rsp_ws"].get(f"A{mark+2}:G{mark+1+limit if limit else ''}")
+        except gspread.exceptions.APIError as e:
+            if "exceeds grid limits" in str(e): return [], mark
+            raise
+        return [r[:7]+[""]*(7-len(r)) for r in vals if r], mark+len(vals)
+    def append_responses(self, rows):
+        self.h["rsp_ws"].append_rows(rows)
+    def drop_responses(self, mark):
+        """Xóa `mark` dòng dữ liệu đầu của Responses (đã lưu trữ); dòng sau dồn lên nên mark mới là 0."""
+        if mark: self.h["rsp_ws"].delete_rows(2, mark+1)
+        return 0
+
+    def _answers(self):
+        """Chỉ mục {email: {qid: [số dòng, dòng Answers]}}, nạp 1 lần cho cả tiến trình."""
+        with self.lock:
+            if self.idx is None:
+                prof.miss("answers_index"); idx = {}
+                vals = self.h["ans_ws"].get_all_values()
+                for i,r in enumerate(vals[1:], start=2):
+                    r = r[:7]+[""]*(7-len(r))
+                    if r[0] and r[1]: idx.setdefault(r[0], {})[r[1]] = [i, r]
+                self.idx = idx
+            else: prof.hit("answers_index")
+            return self.idx
+
+    def _upsert(self, rows):
+        """Ghi các dòng Answers: dòng đã có -> 1 batch_update, dòng mới -> 1 append_rows."""
+        with self.lock:
+            idx, upd, new = self._answers(), [], {}
+            for r in rows:
+                cur = idx.get(r[0], {}).get(r[1])
+                if cur:
+                    cur[1] = r
+                    upd.append({"range":f"A{cur[0]}:G{cur[0]}", "values":[r]})
+                else:
+                    new[(r[0], r[1])] = r
+            ws = self.h["ans_ws"]
+            if upd: ws.batch_update(upd)
+            if new:
+                res = ws.append_rows(list(new.values()))
+                first = int(re.search(r"[A-Z]+(\d+)", res["updates"]["updatedRange"]
+                                      .split("!")[-1]).group(1))
+                for k,r in enumerate(new.values()):
+                    idx.setdefault(r[0], {})[r[1]] = [first+k, r]
+
+    def user_state(self, email):
+        with self.lock:
+            mine = [r for _,r in self._answers().get(email, {}).values()]
+        edits = max((int(r[6] or 0) for r in mine), default=0)
+        return edits, [[r[5], r[1], r[2], r[3], r[4]] for r in mine]
+
+    def save_user_states(self, states):
+        """Trạng thái của nhiều học viên trong 1 lần _upsert (1 append_rows + tối đa 1 batch_update)."""
+        self._upsert([[email, qid, sel, ok, sc, ts, str(edits)]
+                      for email,(rows,edits) in states.items() for ts,qid,sel,ok,sc in rows])
+
+    def regrade(self, qb):
+        """Chấm lại Responses và Answers theo `qb`, chỉ ghi các dòng đổi; trả về số dòng đổi."""
+        n = 0
+        with self.lock:
+            for ws in (self.h["rsp_ws"], self.h["ans_ws"]):
+                vals = [r[:7]+[""]*(7-len(r)) for r in ws.get_all_values()[1:]]
+                if not vals: continue
+                ch = regrade_frame(qb, *zip(*[(r[1], r[2], r[3], r[4]) for r in vals]))
+                if ch:
+                    ws.batch_update([
+                        {"range":f"D{i+2}:E{i+2}", "values":[[ok, sc]]} for i,ok,sc in ch])
+                n += len(ch)
+            self.idx = None   # nạp lại chỉ mục Answers
+        return n
+
+    def migrate_user_sheets(self, drop=False):
+        """Gộp các sheet riêng theo học viên (kiểu cũ, Z1 = số lần nộp) vào Answers.
+
+        Trả về (số sheet đã gộp, tên các sheet không xác định được email)."""
+        wb = self.h["rsp_wb"]
+        known = pd.concat([self.users()["email"], self.responses()["email"]])
+        emails = {sheet_name(e):e for e in known if e}
+        rows, done, skipped = [], [], []
+        with self.lock:
+            have = self._answers()
+            for ws in wb.worksheets():
+                if ws.title in ("Responses","Answers"): continue
+                em = emails.get(ws.title)
+                if not em: skipped.append(ws.title); continue
+                vals = ws.get_all_values()
+                z1 = vals[0][25] if vals and len(vals[0])>25 else ""
+                for r in vals[1:]:
+                    r = r[:5]+[""]*(5-len(r))
+                    if r[1] and r[1] not in have.get(em, {}):
+                        rows.append([em, r[1], r[2], r[3], r[4], r[0], z1.strip() or "0"])
+                done.append(ws)
+            if rows: self._upsert(rows)
+        if drop:
+            for ws in done: wb.del_worksheet(ws)
+        return len(done), skipped
+
+SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users(
+    company TEXT, full_name TEXT, email TEXT NOT NULL, position TEXT,
+    department TEXT, gender TEXT, password TEXT, confirm_password TEXT);
+CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users(email);
+CREATE TABLE IF NOT EXISTS admin(username TEXT PRIMARY KEY, password TEXT);
+CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS questions(
+    qid INTEGER PRIMARY KEY, text TEXT, options TEXT, correct TEXT, points INTEGER);
+CREATE TABLE IF NOT EXISTS responses(
+    id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT NOT NULL, qid TEXT NOT NULL,
+    selected TEXT, is_correct TEXT, score REAL, ts TEXT, edit_no INTEGER);
+CREATE INDEX IF NOT EXISTS responses_email ON responses(email);
+CREATE INDEX IF NOT EXISTS responses_qid ON responses(qid);
+CREATE TABLE IF NOT EXISTS answers(
+    email TEXT NOT NULL, qid TEXT NOT NULL, ts TEXT, selected TEXT,
+    is_correct TEXT, score REAL, edit_no INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY(email, qid));
+"""
+
+class SqlStorage(Storage):
+    """Lưu trong SQLite cục bộ: tra cứu theo chỉ mục email/qid, ghi trong transaction."""
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock:
+            self.db.executescript(SQL_SCHEMA)
+            with self.db:
+                if not self.db.execute("SELECT 1 FROM admin").fetchone():
+                    self.db.execute("INSERT INTO admin VALUES('admin',?)", (hash_pw("admin123"),))
+                if not self.db.execute("SELECT 1 FROM users").fetchone():
+                    pw0 = hash_pw("user123")
+                    self.db.execute("INSERT INTO users VALUES(?,?,?,?,?,?,?,?)", (
+                        "Công ty mặc định","Người dùng","user@example.com",
+                        "Học sinh","CNTT","Nam",pw0,pw0))
+
+    @profiled("sqlite.read_table")
+    def _frame(self, sql, cols, args=()):
+        with self.lock:
+            data = self.db.execute(sql, args).fetchall()
+        return pd.DataFrame([["" if v is None else str(v) for v in r] for r in data],
+                            columns=cols)
+
+    def _run(self, sql, args=(), many=False):
+        with self.lock, self.db:
+            (self.db.executemany if many else self.db.execute)(sql, args)
+
+    def users(self):
+        return self._frame(f"SELECT {','.join(USERS_HDR)} FROM users ORDER BY rowid", USERS_HDR)
+    def add_user(self, row):
+        self._run("INSERT INTO users VALUES(?,?,?,?,?,?,?,?)", row)
+    def set_user_pw(self, email, hashed):
+        self._run("UPDATE users SET password=?, confirm_password=? WHERE email=?",
+                  (hashed, hashed, email))
+
+    def admin_pw(self):
+        with self.lock:
+            r = self.db.execute("SELECT password FROM admin ORDER BY rowid LIMIT 1").fetchone()
+        return r[0] if r else ""
+    def set_admin_pw(self, hashed):
+        self._run("UPDATE admin SET password=? WHERE rowid=(SELECT MIN(rowid) FROM admin)",
+                  (hashed,))
+
+    def questions(self):
+        return self._frame("SELECT qid,text,options,correct,points FROM questions ORDER BY qid",
+                        QUES_HDR)
+    def ques_version(self):
+        with self.lock:
+            r = self.db.execute("SELECT value FROM meta WHERE key='ques_version'").fetchone()
+        return r[0] if r else ""
+    def _bump(self):
+        self.db.execute("INSERT INTO meta VALUES('ques_version',?) "
+                        "ON CONFLICT(key) DO UPDATE SET value=excluded.value", (stamp(),))
+    def bump_ques_version(self):
+        with self.lock, self.db: self._bump()
+    def add_question(self, row):
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO questions VALUES(?,?,?,?,?)", row); self._bump()
+    def update_question(self, qid, row):
+        with self.lock, self.db:
+            self.db.execute("UPDATE questions SET qid=?,text=?,options=?,correct=?,points=? "
+                            "WHERE qid=?", (*row, int(qid)))
+            self._bump()
+    def upsert_questions(self, rows):
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT INTO questions VALUES(?,?,?,?,?) ON CONFLICT(qid) DO UPDATE SET "
+                "text=excluded.text, options=excluded.options, correct=excluded.correct, "
+                "points=excluded.points", rows)
+            self._bump()
+    def renumber_questions(self, mapping):
+        # Chỉ đổi khi id hiện tại đúng bằng khóa của mapping (xem SheetsStorage.renumber_questions).
+        # Đổi qua giá trị tạm (số âm / tiền tố ~) trước để không đụng khóa chính
+        olds = [str(o) for o in mapping]
+        orphan = (f"qid<>'' AND qid NOT GLOB '*[^0-9]*' AND qid NOT IN "
+                  f"({','.join('?'*len(olds))})")
+        with self.lock, self.db:
+            have = sorted(r[0] for r in self.db.execute("SELECT qid FROM questions"))
+            if sorted(mapping) != have: return {}
+            # Câu trả lời cho câu đã xóa thành "x<id>"; bản "x<id>" cũ hơn của cùng học viên
+            # (từ lần đánh số trước) bị thay, tránh trùng khóa (email, qid)
+            self.db.execute(f"DELETE FROM answers WHERE qid LIKE 'x%' AND EXISTS (SELECT 1 FROM "
+                            f"answers a WHERE a.email=answers.email AND 'x'||a.qid=answers.qid "
+                            f"AND {orphan.replace('qid', 'a.qid')})", olds)
+            self.db.executemany("UPDATE questions SET qid=? WHERE qid=?",
+                                [(-n, o) for o,n in mapping.items()])
+            self.db.execute("UPDATE questions SET qid=-qid WHERE qid<0")
+            for tbl in ("responses", "answers"):
+                self.db.execute(f"UPDATE {tbl} SET qid='x'||qid WHERE {orphan}", olds)
+                self.db.executemany(f"UPDATE {tbl} SET qid=? WHERE qid=?",
+                                    [(f"~{n}", str(o)) for o,n in mapping.items()])
+                self.db.execute(f"UPDATE {tbl} SET qid=substr(qid,2) WHERE qid LIKE '~%'")
+            self._bump()
+        return mapping
+
+    def responses(self):
+        return self._frame("SELECT email,qid,selected,is_correct,score,ts,edit_no "
+                        "FROM responses ORDER BY id", RSP_HDR)
+    def responses_since(self, mark, limit=None):
+        with self.lock:
+            data = self.db.execute("SELECT id,email,qid,selected,is_correct,score,ts,edit_no "
+                                   "FROM responses WHERE id>? ORDER BY id LIMIT ?",
+                                   (mark or 0, limit or -1)).fetchall()
+        return ([["" if v is None else str(v) for v in r[1:]] for r in data],
+                data[-1][0] if data else mark or 0)
+    def append_responses(self, rows):
+        self._run("INSERT INTO responses(email,qid,selected,is_correct,score,ts,edit_no) "
+                  "VALUES(?,?,?,?,?,?,?)", rows, many=True)
+    def drop_responses(self, mark):
+        self._run("DELETE FROM responses WHERE id<=?", (mark or 0,))
+        return mark
+
+    def user_state(self, email):
+        with self.lock:
+            rows = self.db.execute("SELECT ts,qid,selected,is_correct,score,edit_no FROM answers "
+                                   "WHERE email=? ORDER BY rowid", (email,)).fetchall()
+        return max((r[5] for r in rows), default=0), [[str(v) for v in r[:5]] for r in rows]
+    def save_user_states(self, states):
+        self._run("INSERT INTO answers(email,ts,qid,selected,is_correct,score,edit_no) "
+                  "VALUES(?,?,?,?,?,?,?) ON CONFLICT(email,qid) DO UPDATE SET "
+                  "ts=excluded.ts, selected=excluded.selected, is_correct=excluded.is_correct, "
+                  "score=excluded.score, edit_no=excluded.edit_no",
+                  [(email, *r, int(edits)) for email,(rows,edits) in states.items() for r in rows],
+                  many=True)
+
+    def regrade(self, qb):
+        n = 0
+        with self.lock, self.db:
+            for tbl in ("responses", "answers"):
+                data = self.db.execute(
+                    f"SELECT rowid,qid,selected,is_correct,score FROM {tbl}").fetchall()
+                if not data: continue
+                keys, *cols = zip(*data)
+                ch = regrade_frame(qb, *cols)
+                self.db.executemany(f"UPDATE {tbl} SET is_correct=?, score=? WHERE rowid=?",
+                                    [(ok, float(sc), keys[i]) for i,ok,sc in ch])
+                n += len(ch)
+        return n
+
+@st.cache_resource
+def store():
+    if STORAGE=="sqlite":
+        return SqlStorage(os.environ.get("APP_DB", os.path.join(DATA_DIR, "testform.db")))
+    return SheetsStorage(gws())
+
+# ------------ Hàng đợi ghi cục bộ (write-behind) ------------
+FLUSH_WAIT  = 2     # giây gom thêm bài nộp trước khi đẩy
+FLUSH_BATCH = 200   # số bài nộp tối đa mỗi lượt đẩy
+class ResponseQueue:
+    """Nhận bài nộp vào SQLite ngay lập tức; luồng nền đẩy dần vào kho lưu trữ.
+
+    Mỗi bài nộp là 1 dòng `pending` (email, lần nộp, các dòng đã chấm) và chỉ bị
+    xóa sau khi đã ghi xong cả sheet Responses lẫn trạng thái trả lời (Answers),
+    nên khởi động lại tiến trình không làm mất bài. Ghi qua `Storage` nên dùng
+    được cho mọi backend."""
+    def __init__(self, path, store):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pending(
+            id INTEGER PRIMARY KEY AUTOINCREMENT, email TEXT NOT NULL,
+            edit_no INTEGER NOT NULL, rows TEXT NOT NULL,
+            master_done INTEGER NOT NULL DEFAULT 0)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pending_email ON pending(email)")
+        self.store = store
+        self.lock = threading.Lock(); self.wake = threading.Event()
+        self.busy = threading.Lock()   # giữ trong suốt 1 lượt đẩy; hold() chờ lượt đang chạy xong
+        threading.Thread(target=self._run, name="rsp-flusher", daemon=True).start()
+
+    def put(self, email, edit_no, rows):
+        """rows: [[timestamp, qid, selected, is_correct, score], ...]"""
+        with self.lock:
+            self.db.execute("INSERT INTO pending(email,edit_no,rows) VALUES(?,?,?)",
+                            (email, int(edit_no), json.dumps(rows)))
+        self.wake.set()
+
+    def pending(self, email):
+        """Các bài nộp của `email` chưa đẩy xong, theo thứ tự nộp."""
+        with self.lock:
+            cur = self.db.execute(
+                "SELECT edit_no,rows FROM pending WHERE email=? ORDER BY id", (email,))
+            return [(en, json.loads(rs)) for en, rs in cur.fetchall()]
+
+    @contextlib.contextmanager
+    def hold(self):
+        """Tạm dừng đẩy bài nộp (vd. trong lúc đánh lại id câu hỏi)."""
+        with self.busy: yield
+
+    def remap(self, mapping):
+        """Đổi question id của các bài nộp chưa đẩy, sau khi kho đã đánh lại id."""
+        with self.lock:
+            items = self.db.execute("SELECT id,rows FROM pending").fetchall()
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE pending SET rows=? WHERE id=?", [
+                (json.dumps([[r[0], remap_qid(r[1], mapping), *r[2:]] for r in json.loads(rs)]), i)
+                for i, rs in items])
+            self.db.execute("COMMIT")
+
+    def _run(self):
+        delay = 1
+        while True:
+            self.wake.wait(30); self.wake.clear()
+            time.sleep(FLUSH_WAIT)
+            try:
+                while True:
+                    with self.busy:
+                        if not self._flush(): break
+                delay = 1
+            except Exception as e:
+                log.warning("Đẩy hàng đợi thất bại, thử lại sau %ss: %s", delay, e)
+                time.sleep(delay+random.random()); delay = min(delay*2, 60)
+                self.wake.set()
+
+    def _flush(self):
+        with self.lock:
+            items = self.db.execute(
+                "SELECT id,email,edit_no,rows,master_done FROM pending ORDER BY id LIMIT ?",
+                (FLUSH_BATCH,)).fetchall()
+        if not items: return False
+        mrows = [[em, r[1], r[2], r[3], r[4], r[0], str(en)]
+                 for _, em, en, rs, done in items if not done for r in json.loads(rs)]
+        if mrows:
+            self.store.append_responses(mrows)   # quota ghi do SheetsGate điều tiết
+            with self.lock:
+                self.db.executemany("UPDATE pending SET master_done=1 WHERE id=?",
+                                    [(it[0],) for it in items])
+        # Trạng thái mới nhất của mọi học viên trong lượt: 1 lần ghi cho cả lớp
+        states = {}
+        for _, em, en, rs, _ in items:
+            rows, edits = states.get(em, ([], 0))
+            states[em] = (rows+json.loads(rs), max(edits, en))
+        self.store.save_user_states(states)
+        with self.lock:
+            self.db.executemany("DELETE FROM pending WHERE id=?", [(it[0],) for it in items])
+        return True
+
+@st.cache_resource
+def rqueue():
+    return ResponseQueue(os.path.join(DATA_DIR, "queue.db"), store())
+
+# ------------ Phiên làm bài & lưu nháp ------------
+EXAM_MINUTES = float(os.environ.get("APP_EXAM_MINUTES", 0))   # 0 = không giới hạn thời gian
+DRAFT_FLUSH  = 3    # giây gom các lần lưu nháp trước khi ghi đĩa
+EXAM_GRACE   = 5    # giây chờ trình duyệt tự nộp trước khi luồng nền nộp thay
+
+class DraftStore:
+    """Phiên làm bài (lần nộp, giờ bắt đầu, hạn nộp) và bài nháp của học viên.
+
+    Chỉ lưu cục bộ (SQLite trong DATA_DIR): mỗi lần chọn đáp án chỉ sửa bản
+    trong bộ nhớ, luồng nền gom mọi thay đổi và ghi đĩa mỗi DRAFT_FLUSH giây
+    trong 1 transaction, nên lưu nháp không tốn lệnh Sheets nào. Khi nộp (bấm
+    nộp hoặc hết giờ, kể cả lúc học viên đã mất kết nối) chỉ trạng thái cuối
+    được chấm và đưa vào hàng đợi bài nộp."""
+    def __init__(self, path, queue):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS drafts(
+            email TEXT PRIMARY KEY, attempt INTEGER NOT NULL, started REAL NOT NULL,
+            deadline REAL, answers TEXT NOT NULL)""")
+        self.queue, self.qb = queue, None   # qb: ngân hàng câu hỏi mới nhất mà trang làm bài đã dùng
+        self.lock, self.dirty = threading.RLock(), set()
+        self.mem = {em: {"attempt": at, "started": st0, "deadline": dl, "answers": json.loads(ans)}
+                    for em, at, st0, dl, ans in self.db.execute("SELECT * FROM drafts")}
+        threading.Thread(target=self._run, name="draft-flusher", daemon=True).start()
+
+    def get(self, email):
+        with self.lock:
+            ex = self.mem.get(email)
+            return ex and {**ex, "answers": dict(ex["answers"])}
+
+    def start(self, email, attempt, answers, minutes=EXAM_MINUTES):
+        now = time.time()
+        ex = {"attempt": attempt, "started": now, "deadline": now+minutes*60 if minutes else None,
+              "answers": {k: list(v) for k, v in answers.items() if v}}
+        with self.lock:
+            self.mem[email] = ex; self.dirty.discard(email)
+            self.db.execute("INSERT OR REPLACE INTO drafts VALUES(?,?,?,?,?)",
+                            (email, attempt, now, ex["deadline"], json.dumps(ex["answers"])))
+
+    def put(self, email, qid, labels):
+        """Lưu nháp 1 câu: chỉ sửa bộ nhớ, luồng nền ghi đĩa sau. Hết giờ thì bỏ qua
+        (trả về False) để bài được nộp đúng như lúc hết hạn."""
+        with self.lock:
+            ex = self.mem.get(email)
+            if ex is None or ex["deadline"] and ex["deadline"] <= time.time(): return False
+            if labels: ex["answers"][qid] = list(labels)
+            else: ex["answers"].pop(qid, None)
+            self.dirty.add(email)
+            return True
+
+    def remap(self, mapping):
+        """Đổi question id trong các bài nháp (câu đã xóa thành "x<id>", không được chấm)."""
+        with self.lock:
+            for em, ex in self.mem.items():
+                ex["answers"] = {remap_qid(k, mapping): v for k, v in ex["answers"].items()}
+                self.dirty.add(em)
+
+    def finish(self, email):
+        with self.lock:
+            self.mem.pop(email, None); self.dirty.discard(email)
+            self.db.execute("DELETE FROM drafts WHERE email=?", (email,))
+
+    def submit(self, email, qb):
+        """Chấm bài nháp và đưa vào hàng đợi; trả về số câu đã nộp (0 nếu bài trống)."""
+        with self.lock:
+            ex = self.mem.get(email)
+            if ex is None: return 0
+            ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            done = {qid: ",".join(sel) for qid, sel in sorted(
+                    ((k, v) for k, v in ex["answers"].items() if qb.get(k)), key=lambda kv: int(kv[0]))}
+            if not done: return 0
+            oks, scs = grade(qb, list(done), list(done.values()))
+            self.queue.put(email, ex["attempt"],
+                           [[ts, qid, sel, str(bool(ok)), str(float(sc)) if ok else "0"]
+                            for (qid, sel), ok, sc in zip(done.items(), oks, scs)])
+            self.finish(email)
+            return len(done)
+
+    def _run(self):
+        while True:
+            time.sleep(DRAFT_FLUSH)
+            try: self._flush(); self._expire()
+            except Exception as e: log.warning("Lưu nháp thất bại: %s", e)
+
+    def _flush(self):
+        with self.lock:
+            rows = [(json.dumps(self.mem[em]["answers"]), em) for em in self.dirty if em in self.mem]
+            self.dirty.clear()
+            if rows:
+                with self.db: self.db.executemany("UPDATE drafts SET answers=? WHERE email=?", rows)
+
+    def _expire(self):
+        """Nộp thay các phiên đã hết giờ mà trình duyệt không tự nộp (mất kết nối, đóng tab)."""
+        now = time.time()
+        with self.lock:
+            late = [em for em, ex in self.mem.items() if ex["deadline"] and ex["deadline"]+EXAM_GRACE < now]
+        if not late: return
+        qb = self.qb or QuestionBank(self.queue.store.questions(), "")
+        for em in late:
+            n = self.submit(em, qb)
+            if not n: self.finish(em)
+            log.info("Hết giờ: đã tự nộp %d câu của %s", n, em)
+
+@st.cache_resource
+def drafts():
+    return DraftStore(os.path.join(DATA_DIR, "drafts.db"), rqueue())
+
 # ------------ DataFrame Helpers ------------
-def _df(ws):
+@profiled("sheets.read_table")
+def _df(ws, ncols=None):
     data = ws.get_all_values()
+    if ncols: data = [r[:ncols] for r in data]
     if len(data) <= 1:
         cols = [c.lower() for c in data[0]] if data else []
         return pd.DataFrame(columns=cols)
     return pd.DataFrame(data[1:], columns=[c.lower() for c in data[0]])
 
-@st.cache_data(ttl=300)
-def df_users():      return _df(gws()["users"])
-@st.cache_data(ttl=300)
-def df_questions():  return _df(gws()["ques"])
-@st.cache_data(ttl=300)
-def df_responses():  return _df(gws()["rsp_ws"])
+# ------------ Danh bạ đăng nhập ------------
+norm_email = lambda em: em.strip().lower()
+
+class UserDirectory:
+    """Danh bạ học viên theo email chuẩn hóa, nạp 1 lần cho cả tiến trình.
+
+    Đăng ký mới được chèn thẳng vào danh bạ thay vì xóa cache; khi tra không
+    thấy, danh bạ chỉ nạp lại từ kho nếu lần nạp trước đã quá `reload_after` giây."""
+    def __init__(self, store, reload_after=60):
+        self.store, self.reload_after = store, reload_after
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        by = {}
+        for r in self.store.users().to_dict("records"):
+            if r["email"]: by.setdefault(norm_email(r["email"]), r)
+        self.by_email, self.t = by, time.monotonic()
+
+    def get(self, em):
+        key = norm_email(em)
+        with self.lock:
+            if key in self.by_email: prof.hit("users"); return self.by_email[key]
+            prof.miss("users")
+            if time.monotonic()-self.t > self.reload_after: self._load()
+            return self.by_email.get(key)
+
+    def add(self, row):
+        r = dict(zip(USERS_HDR, row))
+        with self.lock: self.by_email.setdefault(norm_email(r["email"]), r)
+
+    def set_pw(self, em, hashed):
+        with self.lock:
+            r = self.by_email.get(norm_email(em))
+            if r: r["password"] = r["confirm_password"] = hashed
+
+@probed("users_dir", st.cache_resource(show_spinner=False))
+def users_dir():  return UserDirectory(store())
+
+# Mật khẩu Admin: cache đến khi chính app đổi/đặt lại mật khẩu
+@probed("admin_pw", st.cache_data(show_spinner=False))
+def admin_pw():   return store().admin_pw()
 
 # ------------ Utilities ------------
-hash_pw    = lambda x: hashlib.sha256(x.encode()).hexdigest()
-verify_pw  = lambda s,p: s.strip()==hash_pw(p.strip())
-cmp_ans    = lambda sel,cor: {s.strip().upper() for s in sel}=={c.strip().upper() for c in cor}
+# PBKDF2-HMAC-SHA256; 100k vòng ~50ms/lần trên 1 nhân (hashlib nhả GIL nên
+# nhiều phiên đăng nhập cùng lúc chạy song song). Hash SHA-256 cũ vẫn kiểm tra
+# được và được băm lại khi đăng nhập thành công.
+PW_ITERS = int(os.environ.get("APP_PW_ITERS", "100000"))
+
+def hash_pw(x, iters=PW_ITERS):
+    salt = os.urandom(16)
+    dk = hashlib.pbkdf2_hmac("sha256", x.encode(), salt, iters)
+    return f"pbkdf2_sha256${iters}${salt.hex()}${dk.hex()}"
+
+def verify_pw(s, p):
+    s, p = s.strip(), p.strip()
+    if s.startswith("pbkdf2_sha256$"):
+        try:
+            _, it, salt, dk = s.split("$")
+            calc = hashlib.pbkdf2_hmac("sha256", p.encode(), bytes.fromhex(salt), int(it))
+        except ValueError: return False   # giá trị băm hỏng: coi như sai mật khẩu
+        return hmac.compare_digest(calc.hex().encode(), dk.encode())
+    return hmac.compare_digest(s.encode(), hashlib.sha256(p.encode()).hexdigest().encode())
+
+needs_rehash = lambda s: not s.strip().startswith(f"pbkdf2_sha256${PW_ITERS}$")
 sheet_name = lambda em: re.sub(r'[^A-Za-z0-9_-]','_',em)[:100]
+stamp      = lambda: datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+def remap_qid(v, mapping):
+    """Đổi question id theo mapping; id của câu đã xóa thành "x<id>" để không trùng id mới."""
+    s = v.strip()
+    if not s.isdigit(): return v
+    return str(mapping[int(s)]) if int(s) in mapping else f"x{s}"
+
+def _num(x):
+    try: return float(x)
+    except (TypeError, ValueError): return 0.0
+
+# ------------ Ngân hàng câu hỏi ------------
+Question = namedtuple("Question",
+                      "qid text options lines labels texts answer correct points mask")
+MAX_OPTIONS = 26   # số phương án tối đa mỗi câu (mỗi nhãn 1 bit, không đụng BAD_BIT)
+BAD_BIT  = 1<<62   # nhãn đã chọn không có trong phương án -> không bao giờ khớp
+NO_MASK  = -1      # đáp án đúng có nhãn không có trong phương án -> không bài nào khớp
+
+def option_labels(opts):
+    """Nhãn phương án (phần trước dấu "." ở mỗi dòng)."""
+    return [l.split('.')[0].strip() for l in opts.splitlines() if l.strip()]
+
+class QuestionBank:
+    """Ngân hàng câu hỏi bất biến: phân tích 1 lần, dùng chung chỉ-đọc cho mọi phiên.
+
+    Mỗi câu đã tách sẵn các dòng phương án, nhãn, nội dung và tập đáp án đúng
+    (viết hoa); `by_id` tra câu hỏi theo id. Mỗi nhãn ứng với 1 bit (chỉ MAX_OPTIONS
+    nhãn đầu, nhãn thừa coi như không có), `mask` là bitmask đáp án đúng; `bitmap`/`masks`/`pts` là bảng tra cho bộ chấm điểm."""
+    def __init__(self, df, version):
+        items, bitmap = [], {}
+        for r in df.itertuples(index=False):
+            qid, text, opts, ans, pts = (str(v) for v in r[:5])
+            if not qid.strip().isdigit(): continue
+            lines = tuple(l for l in opts.splitlines() if l.strip())
+            labels = tuple(l.split('.')[0].strip() for l in lines)
+            correct = frozenset(c.strip().upper() for c in ans.split(',') if c.strip())
+            bits = {}
+            for i,lab in enumerate(labels[:MAX_OPTIONS]): bits.setdefault(lab.upper(), 1<<i)
+            items.append(Question(
+                int(qid), text, opts, lines, labels,
+                tuple(l[l.find('.')+1:].strip() for l in lines),
+                ans, correct, _num(pts),
+                NO_MASK if correct-bits.keys() else sum(bits[c] for c in correct)))
+            bitmap.update({f"{int(qid)}|{lab}":b for lab,b in bits.items()})
+        items.sort(key=lambda q: q.qid)
+        self.version    = version
+        self.items      = tuple(items)
+        self.by_id      = MappingProxyType({q.qid:q for q in items})
+        self.max_points = sum(q.points for q in items)
+        self.bitmap     = pd.Series(bitmap, dtype="int64")
+        self.masks      = pd.Series({str(q.qid):q.mask for q in items}, dtype="int64")
+        self.pts        = pd.Series({str(q.qid):q.points for q in items}, dtype="float64")
+
+    def __len__(self):  return len(self.items)
+    def __iter__(self): return iter(self.items)
+    def get(self, qid):
+        s = str(qid).strip()
+        return self.by_id.get(int(s)) if s.isdigit() else None
+
+# ------------ Nhập/xuất câu hỏi hàng loạt ------------
+QUES_REQUIRED = ("question text", "options", "correct answers")
+
+def read_question_file(f):
+    """Đọc CSV/XLSX (cùng header với sheet Questions) thành DataFrame chuỗi."""
+    name = getattr(f, "name", str(f)).lower()
+    df = (pd.read_excel(f, dtype=str, keep_default_na=False) if name.endswith((".xlsx", ".xls"))
+          else pd.read_csv(f, dtype=str, keep_default_na=False, encoding="utf-8-sig"))
+    return df.rename(columns=lambda c: str(c).strip().lower())
+
+def parse_questions(df, next_id=1):
+    """Kiểm tra từng dòng; trả về (dòng hợp lệ [qid,text,options,correct,points], lỗi [(dòng, lý do)]).
+
+    Nhãn phương án lấy theo phần trước dấu "." ở mỗi dòng của ô options; đáp án
+    đúng phải là các nhãn có trong đó. Dòng không có id được cấp id tiếp theo."""
+    miss = [c for c in QUES_REQUIRED if c not in df.columns]
+    if miss: return [], [(0, "Thiếu cột: " + ", ".join(miss))]
+    rows, errs, seen = [], [], set()
+    for i, r in enumerate(df.to_dict("records"), 2):
+        get = lambda c: str(r.get(c, "")).strip()
+        qid, text, opts = get("question id"), get("question text"), get("options")
+        if not (qid or text or opts): continue
+        lines = [l.strip() for l in opts.splitlines() if l.strip()]
+        labs = [l.split(".")[0].strip().upper() for l in lines]
+        corr = [c.strip().upper() for c in get("correct answers").split(",") if c.strip()]
+        pts = get("points") or "1"
+        bad = []
+        if qid and not qid.isdigit(): bad.append(f"id '{qid}' không phải số nguyên dương")
+        if qid in seen: bad.append(f"trùng id {qid}")
+        if not text: bad.append("thiếu nội dung")
+        if len(lines) < 2: bad.append("cần ít nhất 2 phương án")
+        if len(lines) > MAX_OPTIONS: bad.append(f"tối đa {MAX_OPTIONS} phương án")
+        if any("." not in l or not lab for l, lab in zip(lines, labs)): bad.append('phương án phải có dạng "A. nội dung"')
+        if len(set(labs)) < len(labs): bad.append("nhãn phương án bị trùng")
+        if not corr: bad.append("thiếu đáp án đúng")
+        if [c for c in corr if c not in labs]:
+            bad.append("đáp án không có trong phương án: " + ",".join(c for c in corr if c not in labs))
+        if _num(pts) <= 0: bad.append(f"điểm '{pts}' không hợp lệ")
+        if bad: errs.append((i, "; ".join(bad))); continue
+        if qid: seen.add(qid)
+        rows.append([qid, text, "\n".join(lines), ",".join(corr), f"{_num(pts):g}"])
+    # Cấp id cho dòng trống id, tránh các id đã có trong file
+    nid = max([next_id-1, *(int(q) for q in seen)]) + 1
+    for r in rows:
+        if not r[0]: r[0] = str(nid); nid += 1
+    return rows, errs
+
+def diff_questions(qb, rows):
+    """Chia dòng nhập thành (thêm mới, sửa); dòng trùng nội dung với câu hiện có bị bỏ qua."""
+    ins, upd = [], []
+    for r in rows:
+        q = qb.get(r[0])
+        if q is None: ins.append(r)
+        elif (q.text.strip(), "\n".join(q.lines).strip(), ",".join(sorted(q.correct)), f"{q.points:g}") != \
+             (r[1], r[2], ",".join(sorted(r[3].split(","))), r[4]):
+            upd.append(r)
+    return ins, upd
+
+def export_questions(qb, fmt):
+    """Ngân hàng câu hỏi → bytes CSV/XLSX cùng định dạng với file nhập."""
+    df = pd.DataFrame([(q.qid, q.text, q.options, q.answer, f"{q.points:g}") for q in qb],
+                      columns=QUES_HDR)
+    if fmt == "csv": return df.to_csv(index=False).encode("utf-8-sig")
+    buf = io.BytesIO(); df.to_excel(buf, index=False, engine="xlsxwriter")
+    return buf.getvalue()
+
+# ------------ Chấm điểm ------------
+@profiled()
+def grade(qb, qids, sels):
+    """Chấm hàng loạt theo bitmask: qids/sels là dãy chuỗi cùng độ dài.
+
+    Trả về (is_correct, score) dạng mảng numpy; câu hỏi không còn trong
+    ngân hàng được chấm sai, 0 điểm."""
+    qids = pd.Series(qids, dtype=str).str.strip().reset_index(drop=True)
+    if qids.empty: return np.zeros(0, bool), np.zeros(0)
+    labs = (pd.Series(sels, dtype=str).reset_index(drop=True)
+              .str.upper().str.split(",").explode().astype(str).str.strip())
+    labs = labs[labs!=""]
+    keys = qids.loc[labs.index] + "|" + labs
+    bits = keys.map(qb.bitmap).fillna(BAD_BIT).astype("int64")
+    bits = bits[~pd.MultiIndex.from_arrays([bits.index, bits]).duplicated()]   # tổng bit khác nhau = OR
+    sel  = bits.groupby(level=0).sum().reindex(qids.index, fill_value=0)
+    cor  = qids.map(qb.masks)
+    ok   = (sel==cor).to_numpy() & cor.notna().to_numpy()
+    return ok, np.where(ok, qids.map(qb.pts).fillna(0).to_numpy(), 0.0)
+
+@profiled()
+def regrade_frame(qb, qids, sels, oks, scores):
+    """So kết quả chấm lại với giá trị đã lưu; trả về [(vị trí, is_correct, score)] của dòng đổi."""
+    ok, sc = grade(qb, qids, sels)
+    old_ok = pd.Series(oks, dtype=str).reset_index(drop=True).to_numpy()
+    old_sc = pd.to_numeric(pd.Series(scores, dtype=str).reset_index(drop=True),
+                           errors="coerce").fillna(0).to_numpy()
+    pos = np.flatnonzero((old_ok!=np.where(ok,"True","False")) | (old_sc!=sc))
+    return [(int(i), str(bool(ok[i])), str(float(sc[i])) if ok[i] else "0") for i in pos]
+
+# ------------ Ảnh chụp Responses dạng cột (Parquet) ------------
+SNAP_ROWS  = int(os.environ.get("APP_SNAPSHOT_ROWS", 2000))   # nén khi phần đuôi đạt số dòng này
+SNAP_MERGE = 8   # gộp các đoạn cùng đợt khi số file vượt ngưỡng
+
+class ResponseSnapshot:
+    """Lịch sử Responses đã nén thành các đoạn Parquet (zstd) trong DATA_DIR/snapshot.
+
+    email / question id lưu dạng dictionary (categorical), đúng/sai, điểm và
+    "edit no" dạng số. state.json ghi `mark` (vị trí trong kho mà ảnh chụp đã
+    phủ đến, như responses_since) và đợt thi của từng đoạn; đọc ảnh chụp + phần
+    đuôi responses_since(mark) là đủ toàn bộ lịch sử. `gen` tăng mỗi khi nội dung
+    hoặc ý nghĩa của `mark` đổi (lưu trữ, chấm lại, đánh số lại) để thống kê nạp lại."""
+    def __init__(self, root):
+        self.root, self.lock, self._t = root, threading.RLock(), None
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, "state.json")
+        try:
+            with open(self.path) as f: self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {"mark": None, "gen": 0, "segs": [], "runs": []}
+
+    mark = property(lambda self: self.state["mark"])
+    gen  = property(lambda self: self.state["gen"])
+    rows_count = property(lambda self: sum(g["rows"] for g in self.state["segs"]))
+
+    def _save(self, bump=False):
+        if bump: self.state["gen"] += 1
+        with open(self.path+".tmp", "w") as f: json.dump(self.state, f, ensure_ascii=False)
+        os.replace(self.path+".tmp", self.path); self._t = None
+
+    def _file(self, seg): return os.path.join(self.root, seg["file"])
+
+    def _put(self, t, run=None):
+        """Ghi 1 đoạn mới (file tạm rồi đổi tên), trả về mục đoạn cho state."""
+        seg = {"file": f"seg-{stamp()}.parquet", "rows": t.num_rows, "run": run}
+        pq.write_table(t, self._file(seg)+".tmp", compression="zstd")
+        os.replace(self._file(seg)+".tmp", self._file(seg))
+        return seg
+
+    @staticmethod
+    def _table(rows):
+        """Dòng Responses (chuỗi) → bảng Arrow có kiểu."""
+        em, qid, sel, ok, sc, ts, en = (list(c) for c in zip(*(r[:7] for r in rows)))
+        return pa.table({
+            "email":      pa.array(em, pa.string()).dictionary_encode(),
+            "qid":        pa.array([q.strip() for q in qid], pa.string()).dictionary_encode(),
+            "selected":   pa.array(sel, pa.string()),
+            "is_correct": pa.array([v=="True" for v in ok], pa.bool_()),
+            "score":      pa.array([_num(v) for v in sc], pa.float64()),
+            "ts":         pa.array(ts, pa.string()),
+            "edit_no":    pa.array([int(_num(v)) for v in en], pa.int32()),
+        })
+
+    @profiled("snapshot.add")
+    def add(self, rows, base, mark):
+        """Nén `rows` = responses_since(base) vào ảnh chụp; bỏ qua nếu ảnh chụp
+        đã đi tiếp từ chỗ khác (base lệch). Trả về True nếu đã ghi."""
+        with self.lock:
+            if base != self.mark: return False
+            if rows: self.state["segs"].append(self._put(self._table(rows)))
+            self.state["mark"] = mark
+            if len(self.state["segs"]) > SNAP_MERGE: self._merge()
+            self._save()
+            return True
+
+    def _merge(self):
+        """Gộp các đoạn liền nhau cùng đợt thành 1 file (giữ nguyên thứ tự dòng)."""
+        out, old = [], self.state["segs"]
+        for run in dict.fromkeys(g["run"] for g in old):
+            grp = [g for g in old if g["run"]==run]
+            if len(grp) == 1: out += grp; continue
+            out.append(self._put(pa.concat_tables(
+                [pq.read_table(self._file(g)) for g in grp]).unify_dictionaries(), run))
+        self.state["segs"] = out; self._save()
+        for g in old:
+            if g not in out: os.remove(self._file(g))
+
+    @profiled("snapshot.compact")
+    def compact(self, store, chunk=5000):
+        """Nén toàn bộ phần đuôi đang có trên kho; trả về số dòng đã nén."""
+        with self.lock:
+            mark, rows = self.mark, []
+            while True:
+                got, new = store.responses_since(mark, chunk)
+                rows += got
+                if new == (mark or 0): break
+                mark = new
+            if rows or mark != self.mark:
+                self.add(rows, self.mark, mark); self._save(bump=True)
+            return len(rows)
+
+    def archive(self, store, name):
+        """Kết thúc 1 đợt: nén hết rồi xóa khỏi kho các dòng đã nén, các đoạn
+        chưa thuộc đợt nào được gán tên `name`. Trả về số dòng của đợt."""
+        with self.lock:
+            self.compact(store)
+            new = [g for g in self.state["segs"] if g["run"] is None]
+            for g in new: g["run"] = name
+            n = sum(g["rows"] for g in new)
+            self.state["runs"].append({"name": name, "rows": n,
+                                       "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+            self._save()   # ghi state trước khi xóa khỏi kho: lỗi giữa chừng không làm mất dòng
+            self.state["mark"] = store.drop_responses(self.mark)
+            self._save(bump=True)
+            log.info("Đã lưu trữ đợt %s: %d dòng", name, n)
+            return n
+
+    @profiled("snapshot.load")
+    def table(self):
+        """Ảnh chụp của đợt hiện tại (các đoạn chưa lưu trữ; Arrow, đọc qua memory map),
+        giữ trong bộ nhớ đến lần ghi sau. Các đợt đã lưu trữ chỉ đọc qua rows()/export()."""
+        with self.lock:
+            if self._t is None:
+                parts = [pq.read_table(self._file(g), memory_map=True)
+                         for g in self.state["segs"] if g["run"] is None]
+                self._t = pa.concat_tables(parts) if parts else self._table([[""]*7])[:0]
+            return self._t
+
+    def latest(self):
+        """Câu trả lời có "edit no" mới nhất của mỗi (email, question id), gộp bằng pandas."""
+        df = self.table().select(["email","qid","selected","is_correct","score","edit_no"]).to_pandas()
+        df["email"], df["qid"] = df.email.astype(str), df.qid.astype(str).str.strip()
+        df = df[(df.email!="") & (df.qid!="")]
+        return df.sort_values("edit_no", kind="stable").drop_duplicates(["email","qid"], keep="last")
+
+    def rows(self):
+        """Duyệt từng dòng ảnh chụp: (email, qid, đã chọn, đúng?, điểm, thời gian, edit no, đợt)."""
+        with self.lock: segs = list(self.state["segs"])
+        for g in segs:
+            for b in pq.ParquetFile(self._file(g)).iter_batches(5000):
+                d = b.to_pydict()
+                yield from zip(d["email"], d["qid"], d["selected"], d["is_correct"], d["score"],
+                               d["ts"], d["edit_no"], [g["run"] or ""]*b.num_rows)
+
+    def _rewrite(self, fn):
+        """fn(bảng) → bảng mới hoặc None; ghi lại các đoạn có thay đổi. Đợt đã lưu trữ
+        dùng bộ câu hỏi của riêng nó nên không bao giờ bị sửa."""
+        n = 0
+        with self.lock:
+            for i, g in enumerate(self.state["segs"]):
+                if g["run"] is not None: continue
+                t = fn(pq.read_table(self._file(g)))
+                if t is None: continue
+                self.state["segs"][i] = self._put(t, g["run"]); os.remove(self._file(g)); n += 1
+            if n: self._save(bump=True)
+        return n
+
+    def regrade(self, qb):
+        """Chấm lại ảnh chụp đợt hiện tại theo `qb`; trả về số dòng đổi."""
+        n = 0
+        def fn(t):
+            nonlocal n
+            ok, sc = t["is_correct"].to_numpy().copy(), t["score"].to_numpy().copy()
+            ch = regrade_frame(qb, t["qid"].to_pylist(), t["selected"].to_pylist(),
+                               np.where(ok, "True", "False"), sc)
+            if not ch: return None
+            for i, o, s in ch: ok[i], sc[i] = o=="True", float(s)
+            n += len(ch)
+            return t.set_column(3, "is_correct", pa.array(ok)).set_column(4, "score", pa.array(sc))
+        self._rewrite(fn)
+        return n
+
+    def remap(self, mapping):
+        """Đổi question id của đợt hiện tại như Storage.renumber_questions."""
+        def fn(t):
+            qid = t["qid"].to_pylist(); new = [remap_qid(q, mapping) for q in qid]
+            if new == qid: return None
+            return t.set_column(1, "qid", pa.array(new, pa.string()).dictionary_encode())
+        self._rewrite(fn)
+
+    def export(self):
+        """Toàn bộ ảnh chụp (kèm cột đợt) thành 1 file Parquet → bytes, để tải về sao lưu."""
+        with self.lock:
+            parts = [pq.read_table(self._file(g)).append_column(
+                         "run", pa.array([g["run"] or ""]*g["rows"], pa.string()).dictionary_encode())
+                     for g in self.state["segs"]]
+        buf = io.BytesIO()
+        if parts: pq.write_table(pa.concat_tables(parts).unify_dictionaries(), buf, compression="zstd")
+        return buf.getvalue()
+
+    def info(self):
+        with self.lock:
+            size = sum(os.path.getsize(self._file(g)) for g in self.state["segs"])
+            return {"rows": self.rows_count, "segs": len(self.state["segs"]), "bytes": size,
+                    "live": sum(g["rows"] for g in self.state["segs"] if g["run"] is None),
+                    "runs": list(self.state["runs"])}
+
+@st.cache_resource
+def snapshot(): return ResponseSnapshot(os.path.join(DATA_DIR, "snapshot"))
+
+# ------------ Thống kê cộng dồn ------------
+class ResponseStats:
+    """Thống kê theo học viên và theo câu hỏi, cộng dồn từ Responses.
+
+    Lần đầu nạp ảnh chụp Parquet của đợt hiện tại (chỉ giữ dòng mới nhất của mỗi
+    cặp; đợt đã lưu trữ không tính), sau đó chỉ đọc các dòng mới trên kho sau
+    `mark`; mỗi (email, question id) chỉ tính câu trả lời có "edit no" mới nhất,
+    dòng cũ bị trừ ra khi có dòng mới. Phần đuôi
+    đã đọc được nén vào ảnh chụp khi đủ SNAP_ROWS dòng (không tốn thêm lệnh đọc)."""
+    def __init__(self, snap):
+        self.snap, self.lock = snap, threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.mark, self.t, self.gen = None, 0.0, None
+            self.base, self.tail = None, []   # dòng đã đọc sau ảnh chụp (chưa nén), bắt đầu từ base
+            self.latest = {}   # (email, qid) -> (edit no, nhãn đã chọn, đúng?, điểm)
+            self.by_em  = {}   # email -> [số câu, số đúng, điểm]
+            self.by_q   = {}   # qid -> [số câu, số đúng, Counter nhãn]
+
+    def _seed(self):
+        snap = self.snap
+        self.gen, self.mark = snap.gen, snap.mark
+        self.base, df = snap.mark, snap.latest()
+        for em, qid, sel, ok, sc, en in zip(df.email, df.qid, df.selected, df.is_correct,
+                                            df.score, df.edit_no):
+            cur = (int(en), tuple(l.strip().upper() for l in sel.split(",") if l.strip()),
+                   bool(ok), float(sc))
+            self.latest[(em, qid)] = cur; self._add((em, qid), cur, 1)
+
+    @profiled("stats.refresh")
+    def refresh(self, store, every=5):
+        with self.lock, self.snap.lock:
+            if self.gen != self.snap.gen: self.reset(); self._seed()
+            if time.monotonic()-self.t < every: return
+            rows, self.mark = store.responses_since(self.mark)
+            for r in rows: self._fold(*r[:7])
+            self.tail += rows
+            if len(self.tail) >= SNAP_ROWS:
+                self.snap.add(self.tail, self.base, self.mark)
+                self.base, self.tail = self.mark, []
+            self.t = time.monotonic()
+
+    def _fold(self, em, qid, sel, ok, sc, ts, en):
+        if not em or not qid: return
+        en, key = int(_num(en)), (em, qid.strip())
+        prev = self.latest.get(key)
+        if prev and prev[0] > en: return
+        if prev: self._add(key, prev, -1)
+        cur = (en, tuple(l.strip().upper() for l in sel.split(",") if l.strip()),
+               ok=="True", _num(sc))
+        self.latest[key] = cur; self._add(key, cur, 1)
+
+    def _add(self, key, a, k):
+        s = self.by_em.setdefault(key[0], [0, 0, 0.0])
+        s[0] += k; s[1] += k*a[2]; s[2] += k*a[3]
+        q = self.by_q.setdefault(key[1], [0, 0, Counter()])
+        q[0] += k; q[1] += k*a[2]
+        for lab in a[1]: q[2][lab] += k
+
+    @profiled("stats.students")
+    def students(self):
+        with self.lock:
+            data = [(em, *v) for em,v in self.by_em.items() if v[0]>0]
+        return pd.DataFrame(data, columns=["email","Đã_trả_lời","Đúng","Điểm"]).astype(
+            {"Đã_trả_lời":"int64", "Đúng":"int64", "Điểm":"float64"})
+
+    def answers(self):
+        """Bản chụp câu trả lời mới nhất: email -> [(qid, nhãn đã chọn, đúng?, điểm)]."""
+        with self.lock: items = list(self.latest.items())
+        out = {}
+        for (em, qid), (_, labs, ok, sc) in items: out.setdefault(em, []).append((qid, labs, ok, sc))
+        return out
+
+    @profiled("stats.questions")
+    def questions(self):
+        """Độ khó (tỷ lệ đúng) và phân bố lựa chọn theo nhãn của từng câu hỏi."""
+        with self.lock:
+            data = [(qid, v[0], v[1], {l:c for l,c in v[2].items() if c})
+                    for qid,v in self.by_q.items() if v[0]>0]
+        labs = sorted({l for *_,d in data for l in d})
+        df = pd.DataFrame([(qid, n, c, *(d.get(l, 0) for l in labs)) for qid,n,c,d in data],
+                          columns=["question id","Đã_trả_lời","Đúng",*labs])
+        df["Tỷ_lệ_đúng"] = (df.Đúng/df.Đã_trả_lời*100).round(1)
+        key = pd.to_numeric(df["question id"], errors="coerce")
+        return df.iloc[key.argsort(kind="stable")].reset_index(drop=True)
+
+@st.cache_resource
+def stats():  return ResponseStats(snapshot())
+
+# ------------ Xuất báo cáo ------------
+class ExportJobs:
+    """Chạy xuất báo cáo ở luồng nền, mỗi loại 1 việc cho cả tiến trình;
+    file kết quả ghi vào DATA_DIR/exports rồi mới đổi tên, nên không bao giờ tải về file dở."""
+    def __init__(self, root):
+        self.root, self.lock, self.jobs = root, threading.Lock(), {}
+
+    def get(self, kind): return self.jobs.get(kind)
+    def read(self, kind):
+        with open(self.jobs[kind]["path"], "rb") as f: return f.read()
+
+    def start(self, kind, fname, fn):
+        """fn(path, progress) ghi file và trả về số dòng/phiếu đã xuất."""
+        with self.lock:
+            j = self.jobs.get(kind)
+            if j and not j["done"]: return j
+            j = self.jobs[kind] = {"path": os.path.join(self.root, fname), "n": 0,
+                                   "done": False, "err": None, "t0": time.monotonic(), "t": 0.0}
+        def run():
+            tmp = j["path"] + ".part"
+            try:
+                os.makedirs(self.root, exist_ok=True)
+                j["n"] = fn(tmp, lambda n: j.__setitem__("n", n))
+                os.replace(tmp, j["path"])
+            except Exception as e:
+                log.exception("Xuất %s lỗi", kind); j["err"] = str(e)
+            finally:
+                j["t"], j["done"] = time.monotonic()-j["t0"], True
+        threading.Thread(target=run, daemon=True, name=f"export-{kind}").start()
+        return j
+
+@st.cache_resource
+def exports(): return ExportJobs(os.path.join(DATA_DIR, "exports"))
+
+def export_students(path, progress, agg, qb, people):
+    stt, sq = agg.students(), agg.questions()
+    hdr = ["email","full_name","company","Đã_trả_lời","Đúng","Điểm","Chưa_trả_lời","Tỷ_lệ"]
+    def rows():
+        for em, n, c, sc in stt.itertuples(index=False):
+            u = people.get(norm_email(em)) or {}
+            yield em, u.get("full_name",""), u.get("company",""), n, c, sc, len(qb)-n, round(c/n*100, 1)
+    return reports.write_xlsx(path, [("Học viên", hdr, rows()),
+                                     ("Câu hỏi", list(sq.columns), sq.itertuples(index=False))], progress)
+
+def export_history(path, progress, s, snap):
+    """Ảnh chụp (đã nén trước đó, gồm cả các đợt đã lưu trữ) + phần đuôi vừa nén."""
+    snap.compact(s)
+    return reports.write_xlsx(path, [("Responses", RSP_HDR+["run"], snap.rows())], progress)
+
+def export_pdfs(path, progress, agg, qb, people, logo_imgs):
+    def students():
+        for em, ans in sorted(agg.answers().items()):
+            ans = sorted(ans, key=lambda a: (_num(a[0]), a[0]))
+            u = people.get(norm_email(em)) or {}
+            yield {"email": em, "full_name": u.get("full_name",""), "company": u.get("company",""),
+                   "answered": len(ans), "correct": sum(a[2] for a in ans), "total": len(qb),
+                   "score": sum(a[3] for a in ans), "max_points": qb.max_points,
+                   "rows": [(q, ",".join(l), qb.get(q).answer if qb.get(q) else "", ok, sc)
+                            for q, l, ok, sc in ans]}
+    return reports.write_pdf_zip(path, students(), "TUV NORD ONSITE APP - PHIẾU KẾT QUẢ",
+                                 logo_imgs, progress=progress)
+
+# Tem phiên bản đọc lại mỗi 15s; ngân hàng chỉ dựng lại khi tem đổi
+@probed("ques_version", st.cache_data(ttl=15, show_spinner=False))
+def ques_version():  return store().ques_version()
+@probed("bank", st.cache_resource(max_entries=2, show_spinner=False))
+def _bank(version):  return QuestionBank(store().questions(), version)
+def bank():          return _bank(ques_version())
+
+def renumber_questions(mapping):
+    """Đánh lại id câu hỏi ở kho, hàng đợi, bài nháp và ảnh chụp. Hàng đợi tạm dừng
+    trong lúc đổi để không có bài nộp nào được ghi với id cũ; kho có thể làm tiếp
+    lần đổi dở dang nên mapping thực tế lấy theo giá trị kho trả về ({} nếu id đã
+    khác mapping, vd. ngân hàng cũ). Trả về mapping đã áp dụng."""
+    q = rqueue()
+    with q.hold():
+        mapping = store().renumber_questions(mapping)
+        if mapping: q.remap(mapping); drafts().remap(mapping); snapshot().remap(mapping)
+    ques_version.clear(); stats().reset()
+    return mapping
+
+# ------------ Phân trang ------------
+QUIZ_PAGE_SIZE   = int(os.environ.get("APP_QUIZ_PAGE_SIZE", "10"))
+ADMIN_PAGE_SIZES = (10, 20, 50)
+
+def page_slice(n, size, key):
+    """Trang hiện tại lưu ở session_state[key], kẹp trong phạm vi; trả về (trang, số trang, đầu, cuối)."""
+    pages = max(1, -(-n//size))
+    p = min(max(1, st.session_state.get(key, 1)), pages)
+    st.session_state[key] = p
+    return p, pages, (p-1)*size, min(p*size, n)
+
+def page_nav(p, pages, key):
+    if pages<=1: return
+    c1,c2,c3 = st.columns([1,3,1])
+    if c1.button("◀ Trang trước", key=f"{key}_prev", disabled=p<=1):
+        st.session_state[key]=p-1; st.rerun()
+    c2.caption(f"Trang {p}/{pages}")
+    if c3.button("Trang sau ▶", key=f"{key}_next", disabled=p>=pages):
+        st.session_state[key]=p+1; st.rerun()
 
 def reset_admin_pw():
     hashed = hash_pw("admin123")
-    gws()["admin"].update("B2", [[hashed]])
+    store().set_admin_pw(hashed); admin_pw.clear()
     st.success("Đã thiết lập lại mật khẩu Admin về **admin123**")
 
 # ============ Trang Đăng nhập / Đăng ký ============
@@ -181,8 +1748,10 @@ def page_login():
             pw = st.text_input("Mật khẩu Admin", type="password")
             c1,c2 = st.columns(2)
             if c1.button("Đăng nhập"):
-                stored = gws()["admin"].cell(2,2).value
+                stored = admin_pw()
                 if verify_pw(stored,pw):
+                    if needs_rehash(stored):
+                        store().set_admin_pw(hash_pw(pw.strip())); admin_pw.clear()
                     st.session_state.role="admin"; st.rerun()
                 else: st.error("Mật khẩu không đúng")
             if c2.button("Đặt lại mật khẩu"):
@@ -191,12 +1760,15 @@ def page_login():
             em = st.text_input("Email")
             pw = st.text_input("Mật khẩu", type="password")
             if st.button("Đăng nhập"):
-                u = df_users(); r = u[u['email']==em]
-                if r.empty:
+                u = users_dir().get(em)
+                if u is None:
                     st.error("Không tìm thấy người dùng")
-                elif verify_pw(r.iloc[0]['password'], pw):
+                elif verify_pw(u['password'], pw):
+                    if needs_rehash(u['password']):
+                        hp = hash_pw(pw.strip())
+                        store().set_user_pw(u['email'], hp); users_dir().set_pw(em, hp)
                     st.session_state.role="part"
-                    st.session_state.email=em
+                    st.session_state.email=u['email']
                     st.rerun()
                 else:
                     st.error("Mật khẩu không đúng")
@@ -215,125 +1787,152 @@ def page_login():
         if ok:
             if p1!=p2:
                 st.error("Mật khẩu không khớp.")
-            elif df_users()['email'].eq(em).any():
+            elif users_dir().get(em) is not None:
                 st.error("Email đã tồn tại.")
             else:
                 hp = hash_pw(p1)
-                retry(lambda: gws()["users"].append_row(
-                    [cp,nm,em,ps,dt,gd,hp,hp]
-                ))
-                df_users.clear()
+                row = [cp,nm,em.strip(),ps,dt,gd,hp,hp]
+                store().add_user(row); users_dir().add(row)
                 st.success("Đăng ký thành công!")
 
 # ============ Trang Quản trị ============
 def page_admin():
     display_logos()
     st.title("Bảng điều khiển Quản trị")
-    tab_m, tab_s, tab_pw = st.tabs([
-        "Quản lý câu hỏi","Thống kê","Đổi mật khẩu"
+    tab_m, tab_s, tab_x, tab_pw, tab_mt = st.tabs([
+        "Quản lý câu hỏi","Thống kê","Xuất báo cáo","Đổi mật khẩu","Bảo trì"
     ])
 
     # Quản lý câu hỏi
-    with tab_m:
-        qd   = df_questions(); ws_q = gws()["ques"]
+    with tab_m, prof.span("admin.questions"):
+        qb   = bank()
         eid  = st.session_state.get("edit_id")
         md   = st.session_state.get("add_mode")
-        st.subheader(f"Tổng số câu hỏi: {len(qd)}")
+        st.subheader(f"Tổng số câu hỏi: {len(qb)}")
+        c1,c2 = st.columns([3,1])
+        kw   = c1.text_input("Tìm theo id hoặc nội dung", key="adm_kw").strip()
+        size = c2.selectbox("Số câu/trang", ADMIN_PAGE_SIZES, key="adm_size")
+        if st.session_state.get("adm_kw_prev")!=kw:
+            st.session_state.adm_kw_prev=kw; st.session_state.adm_page=1
+        shown = [q for q in qb if not kw or kw==str(q.qid) or kw.lower() in q.text.lower()]
+        p,pages,a,b = page_slice(len(shown), size, "adm_page")
         # Đánh lại ID nếu cần
-        if not qd.empty:
-            cur = sorted(qd["question id"].astype(int))
-            exp = list(range(1,len(qd)+1))
+        if len(qb):
+            cur = [q.qid for q in qb]
+            exp = list(range(1,len(qb)+1))
             if cur!=exp:
                 st.warning("ID không liên tục, đang đánh số lại...")
-                mapping={o:n for o,n in zip(cur,exp)}
-                for old,new in mapping.items():
-                    ridx=qd[qd["question id"].astype(int)==old].index[0]+2
-                    ws_q.update_cell(ridx,1,str(new))
-                df_questions.clear(); st.success("Xong"); st.rerun()
+                if renumber_questions({o:n for o,n in zip(cur,exp)}):
+                    st.success("Xong"); st.rerun()
+                st.error("Cột id vừa thay đổi (phiên khác đã đánh lại) hoặc bị trùng id; "
+                         "tải lại trang để kiểm tra.")
         # Show & Edit
-        if not qd.empty:
-            qd["question id"]=qd["question id"].astype(int)
-            qd=qd.sort_values("question id")
-            for _,r in qd.iterrows():
-                qid=int(r["question id"])
-                if eid==qid:
-                    st.markdown(f"### ✏️ Chỉnh sửa câu hỏi {qid}")
-                    with st.form(f"edit_{qid}"):
-                        txt=st.text_area("Nội dung câu hỏi", value=r["question text"])
-                        opts=st.text_area("Các phương án", value=r["options"])
-                        labs=[l.split('.')[0].strip() for l in opts.splitlines() if l.strip()]
-                        st.write("Đáp án đúng:")
-                        prev=set(r["correct answers"].split(','))
-                        corr=[]; cols=st.columns(len(labs))
-                        for i,lab in enumerate(labs):
-                            if cols[i].checkbox(lab, value=lab in prev, key=f"cb_{qid}_{lab}"):
-                                corr.append(lab)
-                        pts=st.number_input("Điểm",min_value=1,value=int(r["points"]))
-                        luu=st.form_submit_button("Lưu"); huy=st.form_submit_button("Hủy")
-                    if luu:
-                        rownew=[str(qid),txt,opts,",".join(corr),str(int(pts))]
-                        ridx=qd[qd["question id"]==qid].index[0]+2
-                        retry(lambda: ws_q.update(f"A{ridx}:E{ridx}",[rownew]))
-                        df_questions.clear(); st.session_state.pop("edit_id")
-                        st.success("Đã lưu"); st.rerun()
-                    if huy:
-                        st.session_state.pop("edit_id"); st.rerun()
-                else:
-                    st.markdown(f"### {qid}. {r['question text']}")
-                    corr=set(r["correct answers"].split(','))
-                    for line in r["options"].splitlines():
-                        lab=line.split('.')[0].strip()
-                        st.checkbox(line, value=lab in corr, disabled=True,
-                                    key=f"ro_{qid}_{lab}")
-                    st.caption(f"Điểm: {r['points']}")
-                    if st.button("Chỉnh sửa", key=f"btn_{qid}"):
-                        st.session_state.edit_id=qid; st.rerun()
-                    st.write("---")
+        for q in shown[a:b]:
+            qid=q.qid
+            if eid==qid:
+                st.markdown(f"### ✏️ Chỉnh sửa câu hỏi {qid}")
+                with st.form(f"edit_{qid}"):
+                    txt=st.text_area("Nội dung câu hỏi", value=q.text)
+                    opts=st.text_area("Các phương án", value=q.options)
+                    labs=option_labels(opts)
+                    st.write("Đáp án đúng:")
+                    corr=[]; cols=st.columns(len(labs))
+                    for i,lab in enumerate(labs):
+                        if cols[i].checkbox(lab, value=lab.upper() in q.correct,
+                                            key=f"cb_{qid}_{lab}"):
+                            corr.append(lab)
+                    pts=st.number_input("Điểm",min_value=1,value=max(1,int(q.points)))
+                    luu=st.form_submit_button("Lưu"); huy=st.form_submit_button("Hủy")
+                bad=[c for c in corr if c.upper() not in {l.upper() for l in option_labels(opts)}]
+                if luu and len(option_labels(opts))>MAX_OPTIONS:
+                    st.error(f"Tối đa {MAX_OPTIONS} phương án.")
+                elif luu and bad:
+                    st.error("Đáp án không có trong phương án: "+",".join(bad))
+                elif luu:
+                    rownew=[str(qid),txt,opts,",".join(corr),str(int(pts))]
+                    store().update_question(qid, rownew)
+                    ques_version.clear(); st.session_state.pop("edit_id")
+                    st.success("Đã lưu"); st.rerun()
+                if huy:
+                    st.session_state.pop("edit_id"); st.rerun()
+            else:
+                st.markdown(f"### {qid}. {q.text}")
+                for line,lab in zip(q.lines, q.labels):
+                    st.checkbox(line, value=lab.upper() in q.correct, disabled=True,
+                                key=f"ro_{qid}_{lab}")
+                st.caption(f"Điểm: {q.points:g}")
+                if st.button("Chỉnh sửa", key=f"btn_{qid}"):
+                    st.session_state.edit_id=qid; st.rerun()
+                st.write("---")
+        page_nav(p, pages, "adm_page")
         # Thêm mới
         if md:
-            nid = int(qd["question id"].astype(int).max())+1 if not qd.empty else 1
+            nid = qb.items[-1].qid+1 if len(qb) else 1
             st.markdown(f"### ➕ Thêm câu hỏi {nid}")
             with st.form("add"):
                 txt=st.text_area("Nội dung câu hỏi")
                 opts=st.text_area("Các phương án",value="A. \nB. \nC. \nD. ")
-                labs=[l.split('.')[0].strip() for l in opts.splitlines() if l.strip()]
+                labs=option_labels(opts)
                 st.write("Đáp án đúng:")
                 corr=[]; cols=st.columns(len(labs))
                 for i,lab in enumerate(labs):
                     if cols[i].checkbox(lab, key=f"new_{lab}"): corr.append(lab)
                 pts=st.number_input("Điểm",min_value=1,value=1)
                 luu=st.form_submit_button("Lưu"); huy=st.form_submit_button("Hủy")
-            if luu:
-                retry(lambda: ws_q.append_row(
-                    [str(nid),txt,opts,",".join(corr),str(int(pts))]
-                ))
-                df_questions.clear(); st.session_state.pop("add_mode")
+            bad=[c for c in corr if c.upper() not in {l.upper() for l in option_labels(opts)}]
+            if luu and len(option_labels(opts))>MAX_OPTIONS:
+                st.error(f"Tối đa {MAX_OPTIONS} phương án.")
+            elif luu and bad:
+                st.error("Đáp án không có trong phương án: "+",".join(bad))
+            elif luu:
+                store().add_question([str(nid),txt,opts,",".join(corr),str(int(pts))])
+                ques_version.clear(); st.session_state.pop("add_mode")
                 st.success("Đã thêm"); st.rerun()
             if huy:
                 st.session_state.pop("add_mode"); st.rerun()
         if not eid and not md:
             if st.button("➕ Thêm mới"):
                 st.session_state["add_mode"]=True; st.rerun()
+        # Nhập/xuất hàng loạt
+        with st.expander("📥 Nhập / xuất câu hỏi hàng loạt (CSV, XLSX)"):
+            st.caption("Cột: " + ", ".join(QUES_HDR) + ". Mỗi phương án 1 dòng trong ô options "
+                       "(\"A. ...\"); đáp án đúng cách nhau bởi dấu phẩy; để trống id để thêm câu mới.")
+            c1,c2 = st.columns(2)
+            c1.download_button("⬇️ Xuất CSV", lambda: export_questions(bank(), "csv"),
+                               file_name="questions.csv", mime="text/csv")
+            c2.download_button("⬇️ Xuất XLSX", lambda: export_questions(bank(), "xlsx"),
+                               file_name="questions.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            up = st.file_uploader("Tệp câu hỏi", type=["csv","xlsx"], key="ques_file")
+            if up:
+                try:
+                    rows, errs = parse_questions(read_question_file(up),
+                                                 qb.items[-1].qid+1 if len(qb) else 1)
+                except Exception as e:
+                    rows, errs = [], [(0, f"Không đọc được tệp: {e}")]
+                ins, upd = diff_questions(qb, rows)
+                st.write(f"Thêm mới: **{len(ins)}** · Sửa: **{len(upd)}** · "
+                         f"Không đổi: **{len(rows)-len(ins)-len(upd)}** · Lỗi: **{len(errs)}**")
+                if errs:
+                    st.error("Sửa các dòng lỗi rồi tải lại tệp:")
+                    st.dataframe(pd.DataFrame(errs, columns=["dòng","lỗi"]), hide_index=True)
+                if ins or upd:
+                    st.dataframe(pd.DataFrame([["thêm",*r] for r in ins]+[["sửa",*r] for r in upd],
+                                              columns=["thao tác",*QUES_HDR]), hide_index=True)
+                if st.button("Áp dụng", disabled=bool(errs) or not (ins or upd)):
+                    t0=time.perf_counter(); store().upsert_questions(ins+upd); ques_version.clear()
+                    st.success(f"Đã ghi {len(ins)+len(upd)} câu hỏi ({time.perf_counter()-t0:.1f}s).")
+                    if upd: st.info("Có câu hỏi bị sửa: dùng \"Chấm lại\" ở tab Bảo trì nếu đáp án đã đổi.")
 
     # Thống kê
-    with tab_s:
-        qd = df_questions(); rd = df_responses()
-        if rd.empty:
+    with tab_s, prof.span("admin.stats"):
+        import plotly.express as px
+        agg = stats(); agg.refresh(store())
+        stt = agg.students()
+        if stt.empty:
             st.info("Chưa có phản hồi nào.")
         else:
-            if "email" not in rd.columns:
-                for alt in ("User Email","user email","Email", "email"):
-                    if alt in rd.columns:
-                        rd = rd.rename(columns={alt:"email"}); break
-            tot=len(qd)
-            stt = (
-                rd.groupby("email")
-                  .agg(
-                    Đã_trả_lời=("question id","count"),
-                    Đúng=("is correct",lambda x:(x=="True").sum()),
-                    Điểm=("score",lambda x: sum(map(float,x)))
-                  ).reset_index()
-            )
+            tot=len(bank())
             stt["Chưa_trả_lời"] = tot - stt.Đã_trả_lời
             stt["Tỷ_lệ"]       = (stt.Đúng/stt.Đã_trả_lời*100).round(1)
             st.subheader("Thống kê Thí sinh")
@@ -342,6 +1941,17 @@ def page_admin():
                 px.bar(stt, x="email", y="Điểm", color="Tỷ_lệ",
                        title="Điểm của Thí sinh")
             )
+            sq = agg.questions()
+            st.subheader("Thống kê Câu hỏi")
+            st.caption("Tỷ lệ đúng càng thấp thì câu hỏi càng khó; các cột nhãn là số lượt chọn.")
+            st.dataframe(sq)
+            st.plotly_chart(
+                px.bar(sq, x="question id", y="Tỷ_lệ_đúng", title="Tỷ lệ đúng theo câu hỏi")
+            )
+
+    # Xuất báo cáo
+    with tab_x, prof.span("admin.export"):
+        export_panel()
 
     # Đổi mật khẩu
     with tab_pw:
@@ -349,138 +1959,278 @@ def page_admin():
         new1 = st.text_input("Mật khẩu mới",      type="password")
         new2 = st.text_input("Xác nhận mật khẩu mới", type="password")
         if st.button("Đổi mật khẩu"):
-            stored = gws()["admin"].cell(2,2).value
+            stored = admin_pw()
             if not verify_pw(stored,cur):
                 st.error("Mật khẩu không đúng")
             elif new1!=new2:
                 st.error("Mật khẩu mới không khớp")
             else:
-                gws()["admin"].update("B2", [[hash_pw(new1)]])
+                store().set_admin_pw(hash_pw(new1)); admin_pw.clear()
                 st.success("Đổi mật khẩu thành công")
 
+    # Bảo trì
+    with tab_mt, prof.span("admin.maintenance"):
+        st.subheader("Chấm lại toàn bộ")
+        st.caption("Tính lại cột đúng/sai và điểm của mọi câu trả lời theo đáp án hiện tại.")
+        if st.button("Chấm lại"):
+            t0=time.perf_counter(); n=store().regrade(bank())+snapshot().regrade(bank())
+            stats().reset()
+            st.success(f"Đã cập nhật {n} dòng ({time.perf_counter()-t0:.2f}s).")
+        st.subheader("Ngân hàng câu hỏi")
+        st.caption("Dùng khi sửa trực tiếp sheet Questions, để mọi phiên tải lại câu hỏi.")
+        if st.button("🔄 Tải lại ngân hàng câu hỏi"):
+            store().bump_ques_version(); ques_version.clear()
+            st.success("Đã đổi phiên bản ngân hàng câu hỏi.")
+        st.subheader("Lưu trữ lịch sử trả lời")
+        sn=snapshot(); inf=sn.info()
+        st.caption(f"Ảnh chụp Parquet: {inf['rows']:,} dòng trong {inf['segs']} file ({inf['bytes']/1024:.0f} KB), "
+                   f"{inf['live']:,} dòng thuộc đợt hiện tại. Thống kê, phiếu điểm và chấm lại chỉ dùng đợt hiện tại; "
+                   "lịch sử trả lời (Excel) gồm cả các đợt đã lưu trữ.")
+        if inf["runs"]:
+            st.dataframe(pd.DataFrame(inf["runs"]).rename(
+                columns={"name":"Đợt","rows":"Số dòng","at":"Lưu trữ lúc"}), hide_index=True)
+        c1,c2=st.columns(2)
+        if c1.button("Nén ngay"):
+            n=sn.compact(store()); st.success(f"Đã nén {n} dòng mới.")
+        c2.download_button("⬇ Tải ảnh chụp (.parquet)", sn.export, "responses.parquet",
+                           "application/vnd.apache.parquet")
+        with st.form("archive"):
+            name=st.text_input("Tên đợt", value=f"Đợt {datetime.now():%d/%m/%Y}")
+            sure=st.checkbox("Xóa các dòng đã lưu trữ khỏi Responses (chỉ còn trong ảnh chụp ở thư mục dữ liệu)")
+            if st.form_submit_button("Kết thúc đợt & lưu trữ"):
+                if not sure or not name.strip():
+                    st.warning("Nhập tên đợt và đánh dấu xác nhận.")
+                else:
+                    n=sn.archive(store(), name.strip()); stats().reset()
+                    st.success(f"Đã lưu trữ {n} dòng vào đợt \"{name.strip()}\".")
+        st.subheader("Logo")
+        logo_admin()
+        if store().remote:
+            st.subheader("Lưu lượng Google Sheets")
+            st.caption(f"Quota: {SHEETS_READS_PM} lệnh đọc và {SHEETS_WRITES_PM} lệnh ghi mỗi phút (tính từ lúc tiến trình khởi động).")
+            st.dataframe(pd.DataFrame(gclient().gate.metrics.rows()), hide_index=True)
+        if hasattr(store(), "migrate_user_sheets"):
+            st.subheader("Gộp sheet riêng của học viên vào sheet Answers")
+            drop = st.checkbox("Xóa các sheet riêng sau khi gộp")
+            if st.button("Gộp dữ liệu"):
+                n, skipped = store().migrate_user_sheets(drop)
+                st.success(f"Đã gộp {n} sheet học viên.")
+                if skipped:
+                    st.warning("Không xác định được email của: " + ", ".join(skipped))
+
+EXPORTS = (   # loại, nhãn, tên file, mime
+    ("students", "Thống kê học viên (Excel)", "thong_ke_hoc_vien.xlsx",
+     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    ("history", "Lịch sử trả lời (Excel)", "lich_su_tra_loi.xlsx",
+     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    ("pdfs", "Phiếu điểm từng học viên (PDF, nén zip)", "phieu_diem.zip", "application/zip"),
+)
+
+@st.fragment
+def export_panel():
+    """Tạo file ở luồng nền (không chặn app); chỉ phần tiến độ của file đang tạo tự làm mới."""
+    st.caption("File được tạo ở nền; có thể chuyển tab khác trong lúc chờ.")
+    jobs = exports()
+    for kind, label, fname, mime in EXPORTS:
+        st.markdown(f"**{label}**")
+        c1, c2 = st.columns([1, 3])
+        j = jobs.get(kind)
+        if c1.button("Tạo file", key=f"exp_{kind}", disabled=bool(j and not j["done"])):
+            agg = stats(); agg.refresh(store(), every=0)
+            people = dict(users_dir().by_email)
+            fn = {"students": lambda p, cb, a=agg, q=bank(): export_students(p, cb, a, q, people),
+                  "history":  lambda p, cb, s=store(), sn=snapshot(): export_history(p, cb, s, sn),
+                  "pdfs":     lambda p, cb, a=agg, q=bank(), im=logos().get():
+                                  export_pdfs(p, cb, a, q, people, im)}[kind]
+            j = jobs.start(kind, fname, fn)
+        if not j: continue
+        if not j["done"]:
+            with c2: export_progress(kind)
+        elif j["err"]:
+            c2.error(f"Lỗi: {j['err']}")
+        elif os.path.exists(j["path"]):
+            c2.download_button(f"⬇️ Tải {fname} ({j['n']} dòng/phiếu, {j['t']:.1f}s)",
+                               lambda k=kind: jobs.read(k),
+                               file_name=fname, mime=mime, key=f"dl_{kind}")
+
+@st.fragment(run_every=2)
+def export_progress(kind):
+    """Chỉ được vẽ khi file đang tạo, nên chỉ khi đó mới tự làm mới; xong thì vẽ lại trang để hiện nút tải."""
+    j = exports().get(kind)
+    if not j or j["done"]: st.rerun()
+    st.info(f"Đang tạo… {j['n']} dòng/phiếu ({time.monotonic()-j['t0']:.0f}s)")
+
 # ============ Trang Thí sinh ============
+def _pick(em, q):
+    """Callback của checkbox: lưu nháp lựa chọn của câu q (chỉ trong bộ nhớ)."""
+    drafts().put(em, str(q.qid), [lab for lab in q.labels if st.session_state.get(f"{q.qid}_{lab}")])
+
+def _time_up(em, qb):
+    """Hết giờ: nộp bài nháp (nếu có) rồi chạy lại cả trang."""
+    n = drafts().submit(em, qb) or drafts().finish(em) or 0
+    st.session_state.quiz_page = 1
+    st.session_state.flash = f"Hết giờ: đã tự nộp {n} câu."; st.rerun()
+
+@st.fragment(run_every=15)
+def exam_timer(em, qb):
+    """Đồng hồ đếm ngược, tự chạy lại mỗi 15 giây; hết giờ thì tự nộp."""
+    ex = drafts().get(em)
+    if ex is None or not ex["deadline"]: return
+    left = ex["deadline"]-time.time()
+    if left <= 0: _time_up(em, qb)
+    st.caption(f"⏱ Còn lại {int(left//60)}:{int(left%60):02d} (hạn nộp "
+               f"{datetime.fromtimestamp(ex['deadline']).strftime('%H:%M')})")
+
+@st.fragment
+def quiz_form(em, qb):
+    """Trang câu hỏi. Là fragment nên mỗi lần chọn chỉ chạy lại phần này; lựa chọn
+    được lưu nháp ngay nên mất kết nối / tải lại trang không mất bài."""
+    dr = drafts(); ex = dr.get(em)
+    if ex is None: st.rerun()   # đã được nộp ở nơi khác
+    if ex["deadline"] and ex["deadline"] <= time.time(): _time_up(em, qb)
+    draft = ex["answers"]
+    p,pages,a,b = page_slice(len(qb), QUIZ_PAGE_SIZE, "quiz_page")
+    st.caption(f"Trang {p}/{pages} · đã chọn {len(draft)}/{len(qb)} câu · tự động lưu nháp")
+    for q in qb.items[a:b]:
+        st.markdown(f"**Câu {q.qid}. {q.text}**")
+        prev=set(draft.get(str(q.qid),()))
+        cols=st.columns(len(q.labels))
+        for i,(lab,txt) in enumerate(zip(q.labels, q.texts)):
+            cols[i].checkbox(f"{lab}. {txt}", value=lab in prev, key=f"{q.qid}_{lab}",
+                             on_change=_pick, args=(em, q))
+        st.write("---")
+    c1,c2,c3=st.columns(3)
+    c1.button("◀ Trang trước", disabled=p<=1, on_click=st.session_state.update, kwargs={"quiz_page":p-1})
+    c2.button("Trang sau ▶", disabled=p>=pages, on_click=st.session_state.update, kwargs={"quiz_page":p+1})
+    if c3.button("Nộp bài"):
+        if not dr.submit(em, qb):
+            st.warning("Bạn chưa chọn đáp án nào.")
+        else:
+            st.session_state.quiz_page=1
+            st.session_state.flash="Nộp bài thành công!"; st.rerun()
+
 def page_part():
     display_logos()
     st.title(f"Chào bạn, {st.session_state.email}")
+    if "flash" in st.session_state: st.success(st.session_state.pop("flash"))
     tab_q, tab_r = st.tabs(["Làm bài","Kết quả của tôi"])
 
-    # Chuẩn bị sheet riêng
-    wb = gws()["rsp_wb"]; wn = sheet_name(st.session_state.email)
-    try:
-        usht = wb.worksheet(wn)
-    except gspread.exceptions.WorksheetNotFound:
-        usht = wb.add_worksheet(wn, rows=100, cols=26)
-        usht.update("A1:E1", [
-            ["Timestamp","Question ID","Selected Answers","Is Correct","Score"]
-        ])
-        usht.update("Z1", [["0"]])
-    if usht.col_count<26:
-        usht.resize(rows=usht.row_count, cols=26)
-    edits = int((usht.acell("Z1").value or "0").strip())
-
-    # Data & form
-    qd = df_questions()
-    if not qd.empty:
-        qd["question id"]=qd["question id"].astype(int)
-        qd=qd.sort_values("question id")
-
-    # Làm bài
-    with tab_q:
+    # Trạng thái trả lời riêng của học viên
+    with prof.span("part.state"): edits, raw = store().user_state(st.session_state.email)
+    # Ghép các bài nộp còn nằm trong hàng đợi (chưa đẩy lên sheet)
+    mine={r[1]:r for r in raw}
+    for en,prs in rqueue().pending(st.session_state.email):
+        edits=max(edits,en)
+        for r in prs: mine[r[1]]=r
+    rows=list(mine.values())
+
+    qb = bank()
+
+    # Làm bài: phiên làm bài + nháp lưu ở DraftStore, nộp qua hàng đợi
+    with tab_q, prof.span("part.quiz"):
+        em, dr = st.session_state.email, drafts()
+        dr.qb = qb
+        ex = dr.get(em)
+        if ex and ex["attempt"]!=edits+1:
+            dr.finish(em); ex=None   # phiên cũ đã được nộp (ở thiết bị khác / tự nộp khi hết giờ)
         if edits>=3:
             st.warning("Bạn đã đạt giới hạn 3 lần nộp.")
+        elif ex is None and EXAM_MINUTES:
+            st.info(f"Bài làm có thời hạn {EXAM_MINUTES:g} phút kể từ khi bấm bắt đầu. "
+                    "Đáp án được lưu nháp tự động; hết giờ bài sẽ được nộp.")
+            if st.button("▶ Bắt đầu làm bài"):
+                dr.start(em, edits+1, {qid:r[2].split(',') for qid,r in mine.items() if r[2]})
+                st.rerun()
         else:
-            raw=usht.get_all_values()[1:]
-            rows=[r[:5]+[""]*(5-len(r)) for r in raw]
-            my = pd.DataFrame(rows, columns=["timestamp","qid","sel","ok","score"])
-            with st.form("quiz"):
-                ans={}
-                for _,q in qd.iterrows():
-                    st.markdown(f"**Câu {q['question id']}. {q['question text']}**")
-                    lines=[l for l in q['options'].splitlines() if l.strip()]
-                    labs=[l.split('.')[0].strip() for l in lines]
-                    prev=set()
-                    rr=my[my.qid==str(q['question id'])]
-                    if not rr.empty: prev=set(rr.iloc[0].sel.split(','))
-                    sel=[]; cols=st.columns(len(labs))
-                    for i,lab in enumerate(labs):
-                        txt=lines[i][lines[i].find('.')+1:].strip() if i<len(lines) else ""
-                        if cols[i].checkbox(f"{lab}. {txt}", value=lab in prev,
-                                            key=f"{q['question id']}_{lab}"):
-                            sel.append(lab)
-                    ans[str(q['question id'])]=sel
-                    st.write("---")
-                sub=st.form_submit_button("Nộp bài")
-            if sub:
-                ts=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                master=gws()["rsp_ws"]
-                for qid,sel in ans.items():
-                    if not sel: continue
-                    qr=qd[qd["question id"]==int(qid)].iloc[0]
-                    ok=cmp_ans(sel, qr["correct answers"].split(','))
-                    sc=float(qr["points"]) if ok else 0
-                    retry(lambda: master.append_row([
-                        st.session_state.email,qid,",".join(sel),str(ok),
-                        str(sc),ts,str(edits+1)
-                    ]))
-                    urow=[ts,qid,",".join(sel),str(ok),str(sc)]
-                    found=usht.findall(qid)
-                    if found:
-                        usht.update(f"A{found[0].row}:E{found[0].row}", [urow])
-                    else:
-                        usht.append_row(urow)
-                usht.update("Z1", [[str(edits+1)]])
-                st.success("Nộp bài thành công!"); st.rerun()
+            if ex is None:
+                dr.start(em, edits+1, {qid:r[2].split(',') for qid,r in mine.items() if r[2]})
+            if dr.get(em)["deadline"]: exam_timer(em, qb)
+            quiz_form(em, qb)
 
     # Kết quả của tôi
-    with tab_r:
-        raw=usht.get_all_values()[1:]
-        rows=[r[:5]+[""]*(5-len(r)) for r in raw]
-        my=pd.DataFrame(rows, columns=["timestamp","qid","sel","ok","score"])
-        if my.empty:
+    with tab_r, prof.span("part.results"):
+        if not rows:
             st.info("Bạn chưa làm câu hỏi nào.")
         else:
-            qd["question id"]=qd["question id"].astype(str)
-            my["qid"]=my["qid"].astype(str)
-            tot=len(qd); ans=len(my)
-            corr=(my.ok=="True").sum()
-            scr=pd.to_numeric(my.score,errors='coerce').fillna(0).sum()
-            mx=pd.to_numeric(qd.points,errors='coerce').fillna(0).sum()
+            tot=len(qb); ans=len(rows)
+            corr=sum(r[3]=="True" for r in rows)
+            scr=sum(_num(r[4]) for r in rows)
             c1,c2,c3,c4=st.columns(4)
             c1.metric("Đã trả lời", f"{ans}/{tot}")
             c2.metric("Đúng",        f"{corr}/{ans}")
-            c3.metric("Điểm",        f"{scr}/{mx}")
+            c3.metric("Điểm",        f"{scr:g}/{qb.max_points:g}")
             c4.metric("Lượt còn lại", f"{2-edits}")
-            for _,r in my.iterrows():
-                subset=qd[qd["question id"]==r.qid]
-                if subset.empty:
-                    with st.expander(f"{r.qid}. [Bị xóa]"):
+            p,pages,a,b=page_slice(len(rows), QUIZ_PAGE_SIZE, "res_page")
+            for ts,qid,sel,ok,_ in rows[a:b]:
+                q=qb.get(qid)
+                if q is None:
+                    with st.expander(f"{qid}. [Bị xóa]"):
                         st.warning("Câu hỏi đã bị xóa bởi Admin.")
-                        st.write("Câu trả lời:", r.sel)
-                        st.write("Thời gian:", r.timestamp)
+                        st.write("Câu trả lời:", sel)
+                        st.write("Thời gian:", ts)
                     continue
-                qr=subset.iloc[0]
-                with st.expander(f"{r.qid}. {qr['question text']}"):
-                    for line in qr['options'].splitlines():
-                        lab=line.split('.')[0].strip()
-                        st.checkbox(line, value=lab in r.sel.split(','), disabled=True,
-                                    key=f"d_{r.qid}_{lab}")
-                    st.write("Đáp án đúng:", qr["correct answers"])
-                    st.write("Kết quả:",     "✅" if r.ok=="True" else "❌")
-                    st.write("Thời gian:",   r.timestamp)
+                with st.expander(f"{qid}. {q.text}"):
+                    for line,lab in zip(q.lines, q.labels):
+                        st.checkbox(line, value=lab in sel.split(','), disabled=True,
+                                    key=f"d_{qid}_{lab}")
+                    st.write("Đáp án đúng:", q.answer)
+                    st.write("Kết quả:",     "✅" if ok=="True" else "❌")
+                    st.write("Thời gian:",   ts)
+            page_nav(p, pages, "res_page")
 
 # ----------- Router -----------
+def profile_panel():
+    """Khung ⏱ ở sidebar admin: bật/tắt đo, chi tiết rerun này, tổng theo span, cache hit/miss."""
+    with st.sidebar.expander("⏱ Hiệu năng", expanded=prof.on):
+        on = st.toggle("Đo thời gian (cả tiến trình)", value=prof.on, key="prof_on")
+        if on != prof.on:
+            prof.on = on; prof.reset(); st.rerun()
+        if not prof.on:
+            st.caption("Đang tắt. Bật sẵn khi khởi động bằng APP_PROFILE=1."); return
+        ms, spans = prof.last()
+        st.caption(f"Rerun này: {ms:.0f} ms tính đến khung này")
+        st.dataframe(pd.DataFrame([("· "*d + n, round((dt or 0)*1000, 1)) for n, dt, d in spans],
+                                  columns=["span", "ms"]), hide_index=True)
+        st.markdown("**Tổng theo span**")
+        st.dataframe(pd.DataFrame(prof.table()), hide_index=True)
+        st.markdown("**Cache**")
+        st.dataframe(pd.DataFrame(prof.caches()), hide_index=True)
+        st.markdown("**Rerun gần đây**")
+        st.dataframe(pd.DataFrame([(r["ts"], r["page"], r["ms"]) for r in reversed(prof.recent)],
+                                  columns=["ts", "trang", "ms"]), hide_index=True)
+        c1, c2 = st.columns(2)
+        c1.download_button("Log JSON", lambda: "\n".join(json.dumps(r, ensure_ascii=False) for r in prof.recent),
+                           file_name="profile.jsonl", mime="application/json")
+        c2.download_button("Prometheus", prof.prometheus, file_name="testform.prom", mime="text/plain")
+        if st.button("Xóa số liệu"): prof.reset()
+
 def main():
     if 'role' not in st.session_state:
         st.session_state.role = None
-    if st.session_state.role is None:
-        page_login()
-    else:
-        if st.sidebar.button("Đăng xuất"):
-            st.session_state.clear(); st.rerun()
-        if st.session_state.role=="admin":
-            page_admin()
+    rqueue()  # khởi động luồng đẩy hàng đợi (kể cả bài còn tồn sau khi khởi động lại)
+    page = st.session_state.role or "login"
+    prof.begin()
+    try:
+        if st.session_state.role is None:
+            with prof.span("page.login"): page_login()
+            if "_ttfp" not in st.session_state:
+                # Thời gian đến lần hiển thị đầu của trang đăng nhập trong phiên này
+                st.session_state._ttfp = (time.perf_counter()-_T0)*1000
+                log.info("Trang đăng nhập hiển thị sau %.0f ms", st.session_state._ttfp)
         else:
-            page_part()
+            if st.sidebar.button("Đăng xuất"):
+                st.session_state.clear(); st.rerun()
+            if st.session_state.role=="admin":
+                with prof.span("page.admin"): page_admin()
+                profile_panel()
+            else:
+                with prof.span("page.part"): page_part()
+    finally:
+        prof.end(page)
 
 if __name__=="__main__":
-    main()
+    if sys.argv[1:]==["setup"]:
+        # Khởi tạo cấu trúc lưu trữ 1 lần: python app.py setup
+        store() if STORAGE=="sqlite" else setup_sheets(gclient())
+    else:
+        main()
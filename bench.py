@@ -0,0 +1,151 @@
+"""Benchmark offline cho app.py: chạy các trang bằng streamlit AppTest trên
+Google Sheets giả (fake_sheets.py), không cần mạng hay credentials.
+
+N học viên (--concurrency phiên cùng lúc) lần lượt: mở trang đăng nhập, đăng
+nhập, chọn đáp án và nộp bài; sau đó 1 admin đăng nhập và mở trang quản trị.
+AppTest không chạy song song được trong 1 tiến trình (mỗi lần chạy thay
+Runtime và st.secrets toàn cục) nên các rerun được xếp hàng; các phiên vẫn đan
+xen nhau và chạy cùng luồng nền của app (hàng đợi bài nộp, quota) như thật.
+Kết quả: thời gian rerun p50/p99 theo từng bước, số lệnh gọi API và độ trễ
+p50/p99 theo thao tác, số lỗi 429 đã tiêm, thời gian hàng đợi đẩy xong bài nộp.
+
+    python bench.py --students 30 --concurrency 10 --latency 80 --p429 0.02
+    python bench.py --json out.json
+"""
+import argparse, json, os, re, sys, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP = os.path.join(HERE, "app.py")
+
+def pct(xs, p):
+    xs = sorted(xs)
+    return xs[min(len(xs)-1, int(round(p/100*(len(xs)-1))))] if xs else 0.0
+
+def seed(fake, app, students, questions, pw):
+    h = app.hash_pw(pw)
+    fake.seed("Users_DB", "Admin", [app.ADMIN_HDR, ["admin", app.hash_pw("admin123")]])
+    fake.seed("Users_DB", "Users", [app.USERS_HDR] + [
+        ["Bench", f"Học viên {i}", f"s{i}@bench.vn", "", "", "", h, h] for i in range(students)])
+    fake.seed("Quiz_Questions", "Questions", [app.QUES_HDR] + [
+        [str(q), f"Câu hỏi {q}", "A. một\nB. hai\nC. ba\nD. bốn", "AC"[q % 2], "1"]
+        for q in range(1, questions+1)])
+    fake.seed("Quiz_Responses", "Responses", [app.RSP_HDR])
+    fake.seed("Quiz_Responses", "Answers", [app.RSP_HDR])
+
+class Runner:
+    def __init__(self, timeout):
+        from streamlit.testing.v1 import AppTest
+        self.AppTest, self.timeout = AppTest, timeout
+        self.times, self.lock, self.failures = defaultdict(list), threading.Lock(), []
+        self.run_lock = threading.Lock()
+
+    def new(self):
+        at = self.AppTest.from_file(APP, default_timeout=self.timeout)
+        at.secrets["gcp_service_account"] = {}
+        return at
+
+    def run(self, at, step):
+        with self.run_lock:
+            t0 = time.perf_counter(); at.run(); dt = time.perf_counter()-t0
+        with self.lock: self.times[step].append(dt)
+        if at.exception: raise RuntimeError(f"{step}: {at.exception[0].value}")
+        return at
+
+    def student(self, i, pw, answers):
+        try:
+            at = self.run(self.new(), "login")
+            at.radio[0].set_value("Học viên"); self.run(at, "login_role")
+            at.text_input[0].input(f"s{i}@bench.vn"); at.text_input[1].input(pw)
+            at.button[0].click(); self.run(at, "login→part")
+            if at.session_state.role != "part":
+                raise RuntimeError("đăng nhập thất bại: " + "; ".join(e.value for e in at.error))
+            done = set()
+            for cb in at.checkbox:
+                m = re.fullmatch(r"(\d+)_([A-Z])", cb.key or "")
+                if m and m.group(1) not in done and len(done) < answers:
+                    cb.check(); done.add(m.group(1))
+            [b for b in at.button if b.label == "Nộp bài"][0].click()
+            self.run(at, "part_submit")
+            self.run(at, "part_rerun")
+            return len(done)
+        except Exception as e:
+            with self.lock: self.failures.append(f"s{i}: {e}")
+            return 0
+
+    def admin(self):
+        at = self.run(self.new(), "login")
+        at.radio[0].set_value("Quản trị"); at.text_input[0].input("admin123")
+        at.button[0].click(); self.run(at, "login→admin")
+        self.run(at, "admin_rerun")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--students", type=int, default=20)
+    ap.add_argument("--concurrency", type=int, default=5)
+    ap.add_argument("--questions", type=int, default=40)
+    ap.add_argument("--answers", type=int, default=10, help="số câu mỗi học viên chọn (trang đầu)")
+    ap.add_argument("--latency", type=float, default=50, help="độ trễ mỗi lệnh API giả (ms)")
+    ap.add_argument("--jitter", type=float, default=20, help="dao động độ trễ ± (ms)")
+    ap.add_argument("--p429", type=float, default=0.0, help="xác suất trả lỗi 429")
+    ap.add_argument("--pw-iters", type=int, default=None, help="số vòng PBKDF2 (mặc định như app)")
+    ap.add_argument("--timeout", type=float, default=120)
+    ap.add_argument("--json", help="ghi kết quả ra file JSON")
+    a = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="testform-bench-")
+    os.environ.update(APP_STORAGE="sheets", APP_DATA_DIR=os.path.join(tmp, "data"))
+    if a.pw_iters: os.environ["APP_PW_ITERS"] = str(a.pw_iters)
+    os.chdir(tmp)   # tránh credentials.json thật trong thư mục làm việc
+    sys.path.insert(0, HERE)
+    import gspread, fake_sheets
+    from google.oauth2.service_account import Credentials
+    import app   # chỉ để lấy header và hash_pw; AppTest tự chạy lại app.py
+
+    fake = fake_sheets.FakeSheets(a.latency/1000, a.jitter/1000, a.p429)
+    pw = "bench123"; seed(fake, app, a.students, a.questions, pw)
+    r = Runner(a.timeout)
+    with mock.patch.object(gspread, "authorize", lambda creds: fake.client()), \
+         mock.patch.object(Credentials, "from_service_account_info", lambda *x, **k: None):
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(a.concurrency) as ex:
+            sent = sum(ex.map(lambda i: r.student(i, pw, a.answers), range(a.students)))
+        t_students = time.perf_counter()-t0
+        # Chờ hàng đợi đẩy hết bài nộp lên sheet Responses
+        rsp = fake.books["Quiz_Responses"]._sheets["Responses"]
+        while rsp._last()-1 < sent and time.perf_counter()-t0 < a.timeout: time.sleep(0.1)
+        t_flush = time.perf_counter()-t0
+        r.admin()
+
+    res = {
+        "config": vars(a),
+        "students_s": round(t_students, 2), "flushed_s": round(t_flush, 2),
+        "responses": rsp._last()-1, "expected": sent, "failures": r.failures,
+        "pages": {k: {"n": len(v), "p50_ms": round(pct(v, 50)*1000, 1),
+                      "p99_ms": round(pct(v, 99)*1000, 1), "max_ms": round(max(v)*1000, 1)}
+                  for k, v in r.times.items()},
+        "api": {op: {"calls": n, "p50_ms": round(pct(fake.times[op], 50)*1000, 1),
+                     "p99_ms": round(pct(fake.times[op], 99)*1000, 1), "429": fake.errors.get(op, 0)}
+                for op, n in sorted(fake.calls.items(), key=lambda x: -x[1])},
+    }
+    res["api_total"] = sum(fake.calls.values())
+
+    print(f"\n{a.students} học viên, song song {a.concurrency}, API giả {a.latency:g}±{a.jitter:g} ms, p429={a.p429}")
+    print(f"Học viên xong sau {res['students_s']}s; hàng đợi đẩy xong {res['responses']}/{sent} dòng sau {res['flushed_s']}s")
+    print(f"\n{'bước':<14}{'n':>5}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for k, v in res["pages"].items():
+        print(f"{k:<14}{v['n']:>5}{v['p50_ms']:>10}{v['p99_ms']:>10}{v['max_ms']:>10}")
+    print(f"\n{'lệnh API':<22}{'lượt':>7}{'p50 ms':>10}{'p99 ms':>10}{'429':>6}")
+    for op, v in res["api"].items():
+        print(f"{op:<22}{v['calls']:>7}{v['p50_ms']:>10}{v['p99_ms']:>10}{v['429']:>6}")
+    print(f"{'tổng':<22}{res['api_total']:>7}")
+    for f in r.failures: print("LỖI", f)
+    if a.json:
+        with open(os.path.join(HERE, a.json) if not os.path.isabs(a.json) else a.json, "w") as f:
+            json.dump(res, f, ensure_ascii=False, indent=2)
+    return 1 if r.failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
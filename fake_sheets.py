@@ -0,0 +1,294 @@
+"""Google Sheets giả lập trong bộ nhớ cho benchmark / chạy thử không cần mạng.
+
+Chỉ cài phần gspread mà app dùng (open, create, worksheet, add_worksheet,
+get_all_values, get, row_values, col_values, append_row(s), update, batch_update,
+values_batch_update, find, findall, acell, cell, resize, delete_rows...). Mỗi lệnh gọi API có
+thể chờ thêm `latency` giây (± `jitter`) và trả lỗi 429 với xác suất `p429`;
+số lượt gọi và độ trễ được ghi theo từng thao tác trong `FakeSheets.calls`.
+
+    fake = FakeSheets(latency=0.08, p429=0.01)
+    gspread.authorize = lambda creds: fake.client()
+
+Các lớp kế thừa Spreadsheet/Worksheet của gspread để app (QuotaSheets) nhận ra,
+nhưng không gọi __init__ gốc nên không cần HTTP client."""
+import random, re, threading, time
+from collections import defaultdict
+import gspread
+from gspread.cell import Cell
+from gspread.utils import rowcol_to_a1, column_letter_to_index
+
+class _Resp:
+    def __init__(self, code, msg):
+        self.status_code, self.text = code, msg
+        self._json = {"error": {"code": code, "message": msg, "status": "FAKE"}}
+    def json(self): return self._json
+
+def api_error(code, msg): return gspread.exceptions.APIError(_Resp(code, msg))
+
+def _ref(a1):
+    """'B12' / 'B' / '12' -> (hàng|None, cột|None), đánh số từ 1."""
+    m = re.fullmatch(r"([A-Za-z]*)(\d*)", a1.strip())
+    return (int(m.group(2)) if m.group(2) else None,
+            column_letter_to_index(m.group(1).upper()) if m.group(1) else None)
+
+def _range(name):
+    """"'Sheet'!A2:G" -> (tên sheet|None, r1, c1, r2|None, c2|None)."""
+    sheet, _, rng = name.rpartition("!")
+    a, _, b = rng.partition(":")
+    r1, c1 = _ref(a); r2, c2 = _ref(b) if b else (r1, c1)
+    return sheet.strip("'") or None, r1 or 1, c1 or 1, r2, c2
+
+class FakeSheets:
+    """Kho dữ liệu dùng chung + bộ đếm lượt gọi cho mọi client giả."""
+    def __init__(self, latency=0.0, jitter=0.0, p429=0.0, seed=None):
+        self.latency, self.jitter, self.p429 = latency, jitter, p429
+        self.rnd = random.Random(seed)
+        self.books, self.lock = {}, threading.RLock()
+        self.calls, self.times, self.errors = defaultdict(int), defaultdict(list), defaultdict(int)
+        self._ids = 0
+
+    def client(self): return FakeClient(self)
+
+    def api(self, op):
+        """Mô phỏng 1 lệnh gọi API: chờ độ trễ, có thể trả 429."""
+        t0 = time.perf_counter()
+        d = self.latency + (self.rnd.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if d > 0: time.sleep(d)
+        with self.lock:
+            self.calls[op] += 1; self.times[op].append(time.perf_counter()-t0)
+            if self.p429 and self.rnd.random() < self.p429:
+                self.errors[op] += 1
+                raise api_error(429, "Quota exceeded for quota metric 'Read requests' (fake)")
+
+    def next_id(self):
+        with self.lock: self._ids += 1; return self._ids
+
+    def reset_stats(self):
+        with self.lock: self.calls.clear(); self.times.clear(); self.errors.clear()
+
+    # Dựng dữ liệu nhanh (không tính lượt gọi)
+    def seed(self, book, title, rows, cols=26):
+        with self.lock:
+            sh = self.books.get(book) or self._new_book(book, None)
+            ws = sh._sheets.get(title) or sh._new(title, max(len(rows), 1), max(cols, *map(len, rows or [[]])))
+            ws._data = [list(map(str, r)) for r in rows]
+            ws._grow(len(rows), 0)
+            return ws
+
+    def _new_book(self, title, first="Sheet1"):
+        sh = FakeSpreadsheet(self, title)
+        if first: sh._new(first, 1000, 26)
+        self.books[title] = sh
+        return sh
+
+class FakeClient:
+    def __init__(self, fake): self.fake = fake
+
+    def open(self, title, folder_id=None):
+        self.fake.api("open")
+        with self.fake.lock:
+            if title not in self.fake.books: raise gspread.exceptions.SpreadsheetNotFound(title)
+            return self.fake.books[title]
+
+    def create(self, title, folder_id=None):
+        self.fake.api("create")
+        with self.fake.lock: return self.fake._new_book(title)
+
+class FakeSpreadsheet(gspread.Spreadsheet):
+    def __init__(self, fake, title):
+        self.fake, self._sheets = fake, {}
+        self._properties = {"id": f"fake-{fake.next_id()}", "title": title}
+
+    def _new(self, title, rows, cols):
+        ws = FakeWorksheet(self, title, rows, cols); self._sheets[title] = ws
+        return ws
+
+    def worksheet(self, title):
+        self.fake.api("worksheet")
+        with self.fake.lock:
+            if title not in self._sheets: raise gspread.exceptions.WorksheetNotFound(title)
+            return self._sheets[title]
+
+    def worksheets(self, exclude_hidden=False):
+        self.fake.api("worksheets")
+        with self.fake.lock: return list(self._sheets.values())
+
+    def get_worksheet(self, index):
+        self.fake.api("get_worksheet")
+        with self.fake.lock:
+            ws = list(self._sheets.values())
+            return ws[index] if index < len(ws) else None
+
+    @property
+    def sheet1(self): return self.get_worksheet(0)
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self.fake.api("add_worksheet")
+        with self.fake.lock:
+            if title in self._sheets:
+                raise api_error(400, f'A sheet with the name "{title}" already exists.')
+            return self._new(title, int(rows), int(cols))
+
+    def del_worksheet(self, worksheet):
+        self.fake.api("del_worksheet")
+        with self.fake.lock: self._sheets.pop(worksheet.title, None)
+
+    def values_batch_update(self, body=None):
+        self.fake.api("values_batch_update")
+        with self.fake.lock:
+            for d in body["data"]:
+                sheet, *_ = _range(d["range"])
+                self._sheets[sheet]._write(d["range"], d["values"])
+        return {"totalUpdatedRanges": len(body["data"])}
+
+class FakeWorksheet(gspread.Worksheet):
+    def __init__(self, sh, title, rows, cols):
+        self.spreadsheet_id, self.client, self._spreadsheet = sh.id, None, sh
+        self.fake, self._data = sh.fake, []
+        self._properties = {"sheetId": sh.fake.next_id(), "title": title,
+                            "gridProperties": {"rowCount": rows, "columnCount": cols}}
+
+    # --- nội bộ ---
+    def _grid(self): return self._properties["gridProperties"]
+    def _grow(self, rows, cols):
+        g = self._grid()
+        g["rowCount"], g["columnCount"] = max(g["rowCount"], rows), max(g["columnCount"], cols)
+    def _cell(self, r, c):
+        return self._data[r-1][c-1] if r <= len(self._data) and c <= len(self._data[r-1]) else ""
+    def _last(self):
+        n = len(self._data)
+        while n and not any(self._data[n-1]): n -= 1
+        return n
+    def _read(self, r1, c1, r2, c2):
+        """Như Sheets API: bỏ ô rỗng cuối dòng và dòng rỗng cuối vùng."""
+        g = self._grid()
+        if r1 > g["rowCount"]:
+            raise api_error(400, f"Range ('{self.title}'!A{r1}) exceeds grid limits. "
+                                 f"Max rows: {g['rowCount']}, max columns: {g['columnCount']}")
+        r2, c2 = min(r2 or g["rowCount"], self._last()), c2 or g["columnCount"]
+        out = []
+        for r in range(r1, r2+1):
+            row = [self._cell(r, c) for c in range(c1, c2+1)]
+            while row and row[-1] == "": row.pop()
+            out.append(row)
+        while out and not out[-1]: out.pop()
+        return out
+    def _write(self, rng, values):
+        _, r1, c1, *_ = _range(rng)
+        self._grow(r1+len(values)-1, c1+max(map(len, values), default=1)-1)
+        for i, vals in enumerate(values):
+            r = r1+i
+            while len(self._data) < r: self._data.append([])
+            row = self._data[r-1]
+            if len(row) < c1-1+len(vals): row.extend([""]*(c1-1+len(vals)-len(row)))
+            row[c1-1:c1-1+len(vals)] = ["" if v is None else str(v) for v in vals]
+
+    # --- API ---
+    def get_all_values(self, *a, **kw):
+        self.fake.api("get_all_values")
+        with self.fake.lock:
+            rows = self._read(1, 1, None, None)
+            w = max(map(len, rows), default=0)
+            return [r+[""]*(w-len(r)) for r in rows]
+
+    def get(self, range_name=None, **kw):
+        self.fake.api("get")
+        with self.fake.lock:
+            _, r1, c1, r2, c2 = _range(range_name)
+            return self._read(r1, c1, r2, c2)
+
+    def row_values(self, row, **kw):
+        self.fake.api("row_values")
+        with self.fake.lock:
+            if row > self._grid()["rowCount"]: return []
+            return (self._read(row, 1, row, None) or [[]])[0]
+
+    def col_values(self, col, **kw):
+        self.fake.api("col_values")
+        with self.fake.lock:
+            vals = [self._cell(r, col) for r in range(1, self._last()+1)]
+            while vals and vals[-1] == "": vals.pop()
+            return vals
+
+    def acell(self, label, **kw):
+        self.fake.api("acell")
+        r, c = _ref(label)
+        with self.fake.lock: return Cell(r, c, self._cell(r, c) or None)
+
+    def cell(self, row, col, **kw):
+        self.fake.api("cell")
+        with self.fake.lock: return Cell(row, col, self._cell(row, col) or None)
+
+    def _find(self, query, in_row=None, in_column=None):
+        out = []
+        for r, row in enumerate(self._data, 1):
+            if in_row and r != in_row: continue
+            for c, v in enumerate(row, 1):
+                if (not in_column or c == in_column) and v == query: out.append(Cell(r, c, v))
+        return out
+
+    def find(self, query, in_row=None, in_column=None, case_sensitive=True):
+        self.fake.api("find")
+        with self.fake.lock:
+            hit = self._find(query, in_row, in_column)
+            return hit[0] if hit else None
+
+    def findall(self, query, in_row=None, in_column=None, case_sensitive=True):
+        self.fake.api("findall")
+        with self.fake.lock: return self._find(query, in_row, in_column)
+
+    def update(self, values=None, range_name=None, **kw):
+        if isinstance(values, str): values, range_name = range_name, values   # kiểu gọi cũ update("A1", [[...]])
+        self.fake.api("update")
+        with self.fake.lock: self._write(range_name or "A1", values)
+        return {"updatedRange": f"'{self.title}'!{range_name}"}
+
+    def update_cell(self, row, col, value):
+        return self.update([[value]], rowcol_to_a1(row, col))
+
+    def batch_update(self, data, **kw):
+        self.fake.api("batch_update")
+        with self.fake.lock:
+            for d in data: self._write(d["range"], d["values"])
+        return {"totalUpdatedRanges": len(data)}
+
+    def append_row(self, values, **kw):
+        return self.append_rows([values], _op="append_row")
+
+    def append_rows(self, values, _op="append_rows", **kw):
+        self.fake.api(_op)
+        with self.fake.lock:
+            first = self._last()+1
+            self._write(f"A{first}", values)
+            end = first+len(values)-1
+            last_col = rowcol_to_a1(1, max(map(len, values), default=1)).rstrip("1")
+            return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{last_col}{end}",
+                                "updatedRows": len(values)}}
+
+    def resize(self, rows=None, cols=None):
+        self.fake.api("resize")
+        with self.fake.lock:
+            g = self._grid()
+            if rows is not None:
+                g["rowCount"] = int(rows); del self._data[int(rows):]
+            if cols is not None:
+                g["columnCount"] = int(cols)
+                for row in self._data: del row[int(cols):]
+
+    def delete_rows(self, start_index, end_index=None):
+        self.fake.api("delete_rows")
+        with self.fake.lock:
+            end = end_index or start_index
+            del self._data[start_index-1:end]
+            self._grid()["rowCount"] -= end-start_index+1
+
+    def update_title(self, title):
+        self.fake.api("update_title")
+        with self.fake.lock:
+            sh = self._spreadsheet
+            sh._sheets = {(title if k == self.title else k): v for k, v in sh._sheets.items()}
+            self._properties["title"] = title
+
+    def clear(self):
+        self.fake.api("clear")
+        with self.fake.lock: self._data = []
@@ -0,0 +1,117 @@
+"""Xuất báo cáo cho trang Admin.
+
+- Excel: ghi từng dòng ra đĩa bằng xlsxwriter (chế độ constant_memory), nên lịch
+  sử trả lời hàng chục nghìn dòng không phải dựng DataFrame.
+- PDF: mỗi học viên 1 phiếu điểm (fpdf2), tạo song song trên nhiều tiến trình và
+  ghi dần vào file zip.
+
+Module không import streamlit để tiến trình con import được `_pdf_job`."""
+import io, os, re, zipfile, unicodedata, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+PDF_WORKERS = int(os.environ.get("APP_EXPORT_WORKERS", 0)) or \
+    (len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1)
+COL_W = (20, 45, 45, 30, 20)   # độ rộng cột bảng câu trả lời (mm)
+PDF_CHUNK = 16   # số phiếu giao cho 1 tiến trình mỗi lượt
+FONT_PATHS = (
+    os.environ.get("APP_PDF_FONT", ""),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+)
+
+# ------------ Excel ------------
+def write_xlsx(path, sheets, progress=None):
+    """sheets: [(tên sheet, header, iterable các dòng)]. Trả về tổng số dòng đã ghi."""
+    import xlsxwriter
+    wb = xlsxwriter.Workbook(path, {"constant_memory": True})
+    bold, n = wb.add_format({"bold": True}), 0
+    try:
+        for name, header, rows in sheets:
+            ws = wb.add_worksheet(name[:31])
+            ws.write_row(0, 0, header, bold)
+            ws.freeze_panes(1, 0)
+            for i, r in enumerate(rows, 1):
+                ws.write_row(i, 0, r); n += 1
+                if progress and n % 1000 == 0: progress(n)
+    finally:
+        wb.close()
+    if progress: progress(n)
+    return n
+
+# ------------ PDF ------------
+def _font():
+    return next((p for p in FONT_PATHS if p and os.path.exists(p)), None)
+
+def _ascii(s):
+    """Bỏ dấu tiếng Việt khi không có font Unicode (font lõi của PDF chỉ có latin-1)."""
+    s = str(s).replace("đ", "d").replace("Đ", "D")
+    return unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode()
+
+def student_pdf(d, title="", logos=()):
+    """Phiếu điểm của 1 học viên → bytes PDF.
+
+    d: email, full_name, company, answered, correct, score, total, max_points,
+    rows [(qid, đã chọn, đáp án, đúng?, điểm)]."""
+    from fpdf import FPDF
+    font, pdf = _font(), FPDF()
+    t = str if font else _ascii
+    if font: pdf.add_font("body", fname=font); face = "body"
+    else: face = "Helvetica"
+    pdf.set_auto_page_break(True, 15); pdf.add_page()
+    x = pdf.l_margin
+    for img in logos:
+        if img: pdf.image(io.BytesIO(img), x=x, y=10, h=20); x += 30
+    if any(logos): pdf.set_y(35)
+    pdf.set_font(face, size=16); pdf.cell(0, 10, t(title or "PHIẾU KẾT QUẢ"), align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.set_font(face, size=11)
+    for k, v in (("Họ tên", d.get("full_name", "")), ("Email", d["email"]),
+                 ("Công ty", d.get("company", "")), ("Ngày", datetime.now().strftime("%d/%m/%Y"))):
+        pdf.cell(0, 7, t(f"{k}: {v}"), new_x="LMARGIN", new_y="NEXT")
+    pct = d["correct"]/d["answered"]*100 if d["answered"] else 0
+    pdf.ln(2); pdf.set_font(face, size=13)
+    pdf.cell(0, 8, t(f"Điểm: {d['score']:g}/{d['max_points']:g}  ·  Đúng {d['correct']}/{d['total']} câu "
+                     f"({pct:.1f}% số câu đã trả lời)"), new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(3); pdf.set_font(face, size=10)
+    # Bảng kẻ ô bằng cell(): nhanh hơn nhiều so với pdf.table() khi tạo hàng trăm phiếu
+    pdf.set_fill_color(220, 220, 220)
+    head = [t(c) for c in ("Câu", "Đã chọn", "Đáp án", "Kết quả", "Điểm")]
+    def header():
+        for c, w in zip(head, COL_W): pdf.cell(w, 7, c, border=1, align="C", fill=True)
+        pdf.ln()
+    header()
+    for qid, sel, cor, ok, sc in d["rows"]:
+        if pdf.will_page_break(7): pdf.add_page(); header()
+        for c, w in zip((t(qid), t(sel), t(cor), t("Đúng" if ok else "Sai"), f"{sc:g}"), COL_W):
+            pdf.cell(w, 7, c, border=1, align="C")
+        pdf.ln()
+    return bytes(pdf.output())
+
+def _pdf_job(args):
+    d, title, logos = args
+    return d["email"], student_pdf(d, title, logos)
+
+def pdf_name(email):
+    return re.sub(r"[^\w.@-]+", "_", email) + ".pdf"
+
+def write_pdf_zip(path, students, title="", logos=(), workers=None, progress=None):
+    """Ghi phiếu điểm của từng học viên vào file zip; các phiếu được tạo trên
+    `workers` tiến trình và ghi ra zip ngay khi xong. Trả về số phiếu."""
+    workers, n = workers or PDF_WORKERS, 0
+    jobs = [(d, title, tuple(logos)) for d in students]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as z:
+        if workers == 1 or len(jobs) <= PDF_CHUNK:
+            out, ex = map(_pdf_job, jobs), None
+        else:
+            ex = ProcessPoolExecutor(min(workers, -(-len(jobs)//PDF_CHUNK)),
+                                     mp_context=multiprocessing.get_context("spawn"))
+            out = ex.map(_pdf_job, jobs, chunksize=PDF_CHUNK)
+        try:
+            for em, data in out:
+                z.writestr(pdf_name(em), data); n += 1
+                if progress: progress(n)
+        finally:
+            if ex: ex.shutdown(cancel_futures=True)
+    return n
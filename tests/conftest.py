@@ -0,0 +1,13 @@
+import os, sys, tempfile
+
+# app.py đọc cấu hình lúc import: dùng thư mục dữ liệu tạm, không đụng data/ thật
+os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="testform-test-"))
+os.environ.setdefault("APP_PW_ITERS", "1000")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import app
+
+def bank(*rows):
+    """QuestionBank từ các dòng (question id, text, options, correct, points); dùng `from conftest import bank`."""
+    return app.QuestionBank(pd.DataFrame([list(r) for r in rows], columns=app.QUES_HDR), "t")
@@ -0,0 +1,45 @@
+import time
+import app
+from conftest import bank
+
+def setup(tmp_path):
+    s = app.SqlStorage(str(tmp_path / "t.db"))
+    q = app.ResponseQueue(str(tmp_path / "queue.db"), s)
+    return s, q, app.DraftStore(str(tmp_path / "drafts.db"), q)
+
+def test_put_is_rejected_after_deadline(tmp_path):
+    _, _, dr = setup(tmp_path)
+    dr.start("u@x", 1, {"1": ["A"]}, minutes=0.5/60)
+    assert dr.put("u@x", "2", ["B"])
+    time.sleep(0.6)
+    assert not dr.put("u@x", "1", ["B"]) and not dr.put("u@x", "2", [])
+    assert dr.get("u@x")["answers"] == {"1": ["A"], "2": ["B"]}
+    assert not dr.put("nobody@x", "1", ["A"])
+
+def test_expired_session_is_submitted_by_background_check(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "EXAM_GRACE", 0)
+    _, q, dr = setup(tmp_path)
+    dr.qb = bank(("1", "q", "A. a\nB. b", "A", "1"), ("2", "q", "A. a\nB. b", "B", "1"))
+    dr.start("u@x", 2, {"1": ["A"], "2": ["A"]}, minutes=0.2/60)
+    with q.hold():
+        dr._expire(); assert dr.get("u@x") is not None   # chưa hết giờ
+        time.sleep(0.3); dr._expire()
+        assert dr.get("u@x") is None
+        [(en, rows)] = q.pending("u@x")
+    assert en == 2 and [(r[1], r[2], r[3]) for r in rows] == [("1", "A", "True"), ("2", "A", "False")]
+
+def test_untimed_session_never_expires(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "EXAM_GRACE", 0)
+    _, _, dr = setup(tmp_path)
+    dr.start("u@x", 1, {}, minutes=0)
+    dr._expire()
+    assert dr.put("u@x", "1", ["A"]) and dr.get("u@x")["deadline"] is None
+
+def test_draft_survives_restart(tmp_path):
+    _, q, dr = setup(tmp_path)
+    dr.start("u@x", 1, {"1": ["A"]}, minutes=30)
+    dr.put("u@x", "2", ["A", "B"]); dr.put("u@x", "1", [])
+    dr._flush()
+    ex = app.DraftStore(str(tmp_path / "drafts.db"), q).get("u@x")
+    assert ex["answers"] == {"2": ["A", "B"]} and ex["attempt"] == 1
+    assert ex["deadline"] == dr.get("u@x")["deadline"]
@@ -0,0 +1,47 @@
+import app
+from conftest import bank
+
+def test_grade_basic():
+    qb = bank(("1", "q1", "A. a\nB. b\nC. c", "A,C", "2"), ("2", "q2", "A. a\nB. b", "B", "1"))
+    ok, sc = app.grade(qb, ["1", "1", "1", "2", " 2", "3"], ["A,C", "c, a", "A", "B", "B", "A"])
+    assert ok.tolist() == [True, True, False, True, True, False]
+    assert sc.tolist() == [2, 2, 0, 1, 1, 0]
+
+def test_duplicate_labels_counted_once():
+    qb = bank(("1", "q", "A. a\nB. b", "A", "1"))
+    ok, _ = app.grade(qb, ["1", "1"], ["A,A", "A,a, A"])
+    assert ok.tolist() == [True, True]
+
+def test_correct_labels_not_in_options_do_not_overflow():
+    # 2 đáp án ngoài phương án từng cộng thành 1<<63 và làm hỏng cả ngân hàng
+    qb = bank(("1", "q", "A. a\nB. b", "E,F", "1"), ("2", "q", "A. a\nB. b", "A", "1"))
+    assert qb.get(1).mask == app.NO_MASK
+    ok, sc = app.grade(qb, ["1", "1", "1", "2"], ["E,F", "A,B", "", "A"])
+    assert ok.tolist() == [False, False, False, True]
+    assert sc.tolist() == [0, 0, 0, 1]
+
+def test_unknown_selected_labels_never_match():
+    qb = bank(("1", "q", "A. a\nB. b", "A", "1"))
+    ok, _ = app.grade(qb, ["1", "1", "1"], ["A,X", "X,Y,Z", "X"])
+    assert not ok.any()
+
+def test_regrade_frame_reports_changes_only():
+    qb = bank(("1", "q", "A. a\nB. b", "B", "3"))
+    ch = app.regrade_frame(qb, ["1", "1", "9"], ["B", "A", "A"],
+                           ["True", "True", "False"], ["3.0", "1", "0"])
+    assert ch == [(1, "False", "0")]
+
+def test_option_labels():
+    assert app.option_labels("A. một\n\nB. hai\n C. ba") == ["A", "B", "C"]
+
+def test_many_options_do_not_overflow():
+    labs = [f"L{i}" for i in range(70)]
+    opts = "\n".join(f"{l}. x" for l in labs)
+    qb = bank(("1", "q", opts, "L0,L5", "1"), ("2", "q", opts, "L62", "1"), ("3", "q", "A. a\nB. b", "A", "1"))
+    ok, _ = app.grade(qb, ["1", "2", "2", "3"], ["L0,L5", "L62", "ZZ", "A"])
+    assert ok.tolist() == [True, False, False, True]   # nhãn thứ 63 vượt MAX_OPTIONS: không chấm đúng được
+
+def test_zero_padded_sheet_ids():
+    qb = bank(("01", "q", "A. a\nB. b", "A", "2"))
+    ok, sc = app.grade(qb, ["1"], ["A"])
+    assert ok.tolist() == [True] and sc.tolist() == [2]
@@ -0,0 +1,26 @@
+import app
+import fake_sheets
+
+def legacy(answers=()):
+    fake = fake_sheets.FakeSheets()
+    fake.seed("Users_DB", "Users", [app.USERS_HDR, ["C", "A", "a@x.vn", "", "", "", "h", "h"]])
+    fake.seed("Users_DB", "Admin", [app.ADMIN_HDR, ["admin", "h"]])
+    fake.seed("Quiz_Questions", "Questions", [app.QUES_HDR, ["1", "q", "A. a\nB. b", "A", "1"]])
+    fake.seed("Quiz_Responses", "Responses", [app.RSP_HDR])
+    fake.seed("Quiz_Responses", "Answers", [app.RSP_HDR, *answers], cols=len(app.RSP_HDR))
+    fake.seed("Quiz_Responses", app.sheet_name("a@x.vn"), [["Timestamp", "Question ID"] + [""]*23 + ["3"],
+                                                          ["t1", "1", "A", "True", "1"]])
+    fake.seed("Quiz_Responses", "nobody", [["Timestamp"]])
+    return fake, app.SheetsStorage(app.LazySheets(fake.client))
+
+def test_setup_migrates_user_sheets_into_empty_answers():
+    fake, s = legacy()
+    app.setup_sheets(fake.client())
+    assert s.user_state("a@x.vn") == (3, [["t1", "1", "A", "True", "1"]])
+    assert app.sheet_name("a@x.vn") in fake.books["Quiz_Responses"]._sheets   # sheet cũ được giữ
+
+def test_setup_leaves_filled_answers_alone():
+    row = ["a@x.vn", "1", "B", "False", "0", "t2", "5"]
+    fake, s = legacy([row])
+    app.setup_sheets(fake.client())
+    assert s.user_state("a@x.vn") == (5, [["t2", "1", "B", "False", "0"]])
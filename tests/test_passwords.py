@@ -0,0 +1,23 @@
+import hashlib
+import pytest
+import app
+
+def test_hash_roundtrip():
+    h = app.hash_pw("mật khẩu")
+    assert h.startswith(f"pbkdf2_sha256${app.PW_ITERS}$") and h != app.hash_pw("mật khẩu")   # salt ngẫu nhiên
+    assert app.verify_pw(h, "mật khẩu") and app.verify_pw(f" {h}\n", " mật khẩu ")
+    assert not app.verify_pw(h, "sai")
+
+def test_legacy_sha256():
+    old = hashlib.sha256(b"user123").hexdigest()
+    assert app.verify_pw(old, "user123") and not app.verify_pw(old, "user124")
+    assert app.needs_rehash(old)
+
+def test_needs_rehash():
+    assert not app.needs_rehash(app.hash_pw("x"))
+    assert app.needs_rehash(app.hash_pw("x", iters=app.PW_ITERS + 1))
+
+@pytest.mark.parametrize("bad", ["pbkdf2_sha256$", "pbkdf2_sha256$abc$00$00", "pbkdf2_sha256$1000$zz$00",
+                                 "pbkdf2_sha256$0$00$00", "pbkdf2_sha256$1000$00$00$00", "pbkdf2_sha256$1000$00$đ", "đ", ""])
+def test_malformed_hash_is_a_wrong_password(bad):
+    assert app.verify_pw(bad, "x") is False
@@ -0,0 +1,69 @@
+import io
+import pandas as pd
+import app
+from conftest import bank
+
+def frame(*rows, cols=app.QUES_HDR):
+    return pd.DataFrame([list(r) for r in rows], columns=cols)
+
+def test_missing_columns():
+    rows, errs = app.parse_questions(pd.DataFrame({"question text": ["q"]}))
+    assert rows == [] and errs == [(0, "Thiếu cột: options, correct answers")]
+
+def test_valid_rows_are_normalised_and_get_ids():
+    df = frame(("", " Câu 1 ", "A. một\n\nB. hai", "a, b", ""),
+               ("7", "Câu 7", "A. x\nB. y", "B", "2"),
+               ("", "Câu mới", "A. x\nB. y", "A", "1.5"))
+    rows, errs = app.parse_questions(df, next_id=5)
+    assert errs == []
+    assert rows == [["8", "Câu 1", "A. một\nB. hai", "A,B", "1"],
+                    ["7", "Câu 7", "A. x\nB. y", "B", "2"],
+                    ["9", "Câu mới", "A. x\nB. y", "A", "1.5"]]
+
+def test_validation_rules():
+    df = frame(("x1", "q", "A. a\nB. b", "A", "1"),      # id không phải số
+               ("3", "", "A. a\nB. b", "A", "1"),        # thiếu nội dung
+               ("4", "q", "A. a", "A", "1"),             # 1 phương án
+               ("5", "q", "A a\nB. b", "B", "1"),        # thiếu dấu "."
+               ("6", "q", "A. a\nA. b", "A", "1"),       # trùng nhãn
+               ("7", "q", "A. a\nB. b", "", "1"),        # thiếu đáp án
+               ("8", "q", "A. a\nB. b", "C,D", "1"),     # đáp án ngoài phương án
+               ("9", "q", "A. a\nB. b", "A", "0"),       # điểm không hợp lệ
+               ("12", "q", "\n".join(f"L{i}. x" for i in range(27)), "L0", "1"),   # quá nhiều phương án
+               ("10", "q", "A. a\nB. b", "A", "1"),
+               ("10", "q", "A. a\nB. b", "A", "1"),      # trùng id
+               ("", "", "", "", ""))                     # dòng trống bị bỏ qua
+    rows, errs = app.parse_questions(df)
+    assert [r[0] for r in rows] == ["10"]
+    msg = dict(errs)
+    assert sorted(msg) == [2, 3, 4, 5, 6, 7, 8, 9, 10, 12]   # số dòng trong file (header là dòng 1)
+    assert "không phải số nguyên" in msg[2]
+    assert "thiếu nội dung" in msg[3]
+    assert "ít nhất 2 phương án" in msg[4]
+    assert 'dạng "A. nội dung"' in msg[5]
+    assert "trùng" in msg[6]
+    assert "thiếu đáp án" in msg[7]
+    assert msg[8].endswith("C,D")
+    assert "điểm" in msg[9]
+    assert "tối đa 26 phương án" in msg[10]
+    assert "trùng id 10" in msg[12]
+
+def test_parsed_rows_always_build_a_bank():
+    rows, _ = app.parse_questions(frame(("1", "q", "A. a\nB. b", "B,A", "2")))
+    qb = bank(*rows)
+    assert app.grade(qb, ["1"], ["A,B"])[0].tolist() == [True]
+
+def test_diff_questions():
+    qb = bank(("1", "q1", "A. a\nB. b", "A,B", "1"), ("2", "q2", "A. a\nB. b", "A", "1"))
+    rows = [["1", "q1", "A. a\nB. b", "B,A", "1"],    # không đổi (thứ tự đáp án khác)
+            ["2", "q2 sửa", "A. a\nB. b", "A", "1"],
+            ["3", "q3", "A. a\nB. b", "B", "1"]]
+    ins, upd = app.diff_questions(qb, rows)
+    assert [r[0] for r in ins] == ["3"] and [r[0] for r in upd] == ["2"]
+
+def test_export_round_trip():
+    qb = bank(("1", "q1", "A. a\nB. b", "A,B", "1"), ("2", "q2", "A. một\nB. hai", "B", "2"))
+    for fmt in ("csv", "xlsx"):
+        f = io.BytesIO(app.export_questions(qb, fmt)); f.name = f"q.{fmt}"
+        rows, errs = app.parse_questions(app.read_question_file(f))
+        assert errs == [] and app.diff_questions(qb, rows) == ([], [])
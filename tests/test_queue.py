@@ -0,0 +1,28 @@
+import app, fake_sheets
+
+def writes(fake):
+    return {op: n for op, n in fake.calls.items() if op in app.SHEETS_WRITE_OPS}
+
+def test_flush_writes_whole_class_in_one_batch(tmp_path):
+    fake = fake_sheets.FakeSheets()
+    fake.seed("Quiz_Responses", "Responses", [app.RSP_HDR])
+    fake.seed("Quiz_Responses", "Answers", [app.RSP_HDR])
+    s = app.SheetsStorage(app.LazySheets(fake.client))
+    q = app.ResponseQueue(str(tmp_path / "queue.db"), s)
+    with q.hold():   # luồng nền không được đẩy xen vào
+        for i in range(30):
+            q.put(f"s{i}@x.vn", 1, [["t", "1", "A", "True", "1"], ["t", "2", "B", "False", "0"]])
+        q.put("s0@x.vn", 2, [["t2", "1", "B", "False", "0"]])
+        fake.reset_stats()
+        assert q._flush()
+        assert writes(fake) == {"append_rows": 2}
+        assert q.pending("s0@x.vn") == []
+        fake.reset_stats()
+        for i in range(30):
+            q.put(f"s{i}@x.vn", 3, [["t3", "2", "A", "False", "0"]])
+        assert q._flush()
+        assert writes(fake) == {"append_rows": 1, "batch_update": 1}
+    rsp = fake.books["Quiz_Responses"]._sheets["Responses"]
+    assert rsp._last() == 1 + 61 + 30
+    edits, rows = s.user_state("s0@x.vn")
+    assert edits == 3 and sorted((r[1], r[2]) for r in rows) == [("1", "B"), ("2", "A")]
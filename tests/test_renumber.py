@@ -0,0 +1,85 @@
+import pytest
+import app, fake_sheets
+
+QUES = [["1", "q1", "A. a\nB. b", "A", "1"], ["3", "q3", "A. a\nB. b", "B", "1"],
+        ["4", "q4", "A. a\nB. b", "A", "1"]]
+RSP = [["u@x.vn", q, "A", "True", "1", "2026-01-01 00:00:00", "1"] for q in ("1", "2", "3", "4")]
+MAPPING = {1: 1, 3: 2, 4: 3}
+EXPECT = ["1", "x2", "2", "3"]   # câu 2 đã bị xóa -> "x2"
+
+def test_remap_qid():
+    assert [app.remap_qid(v, MAPPING) for v in ("1", "2", " 3", "4", "x7", "")] == \
+           ["1", "x2", "2", "3", "x7", ""]
+
+def sheets_store():
+    fake = fake_sheets.FakeSheets()
+    fake.seed("Quiz_Questions", "Questions", [app.QUES_HDR] + QUES)
+    fake.seed("Quiz_Responses", "Responses", [app.RSP_HDR] + RSP)
+    fake.seed("Quiz_Responses", "Answers", [app.RSP_HDR] + RSP, cols=len(app.RSP_HDR))
+    return fake, app.SheetsStorage(app.LazySheets(fake.client))
+
+def qids(s):
+    return (s.questions()["question id"].tolist(), s.responses()["question id"].tolist(),
+            [r[1] for r in s.user_state("u@x.vn")[1]])
+
+def test_renumber_sqlite(tmp_path):
+    s = app.SqlStorage(str(tmp_path / "t.db"))
+    for r in QUES: s.add_question(r)
+    s.append_responses(RSP)
+    s.save_user_states({"u@x.vn": ([[r[5], r[1], r[2], r[3], r[4]] for r in RSP], 1)})
+    v0 = s.ques_version()
+    assert s.renumber_questions(MAPPING) == MAPPING
+    q, rsp, ans = qids(s)
+    assert q == ["1", "2", "3"] and rsp == EXPECT and sorted(ans) == sorted(EXPECT)
+    assert s.ques_version() != v0
+
+def test_renumber_sheets():
+    fake, s = sheets_store()
+    assert s.renumber_questions(MAPPING) == MAPPING
+    q, rsp, ans = qids(s)
+    assert q == ["1", "2", "3"] and rsp == EXPECT and sorted(ans) == sorted(EXPECT)
+    assert not s.ques_version().startswith(app.RENUMBER)
+
+def test_renumber_sheets_resumes_after_failure(monkeypatch):
+    fake, s = sheets_store()
+    ques = fake.books["Quiz_Questions"]._sheets["Questions"]
+    orig = fake_sheets.FakeWorksheet.batch_update
+    def flaky(self, data, **kw):   # B3 (ghi cột A của Questions) lỗi 1 lần
+        if self is ques and any(d["range"].startswith("A2") for d in data):
+            monkeypatch.setattr(fake_sheets.FakeWorksheet, "batch_update", orig)
+            raise fake_sheets.api_error(503, "backend error")
+        return orig(self, data, **kw)
+    monkeypatch.setattr(fake_sheets.FakeWorksheet, "batch_update", flaky)
+    with pytest.raises(Exception):
+        s.renumber_questions(MAPPING)
+    assert s.ques_version().startswith(app.RENUMBER)
+    # Lần sau trang admin tính lại cùng mapping từ cột id chưa đổi; tham chiếu không bị đổi 2 lần
+    assert s.renumber_questions({1: 1, 3: 2, 4: 3}) == MAPPING
+    q, rsp, ans = qids(s)
+    assert q == ["1", "2", "3"] and rsp == EXPECT and sorted(ans) == sorted(EXPECT)
+
+def test_stale_mapping_is_ignored_sqlite(tmp_path):
+    s = app.SqlStorage(str(tmp_path / "t.db"))
+    for r in QUES: s.add_question(r)
+    s.append_responses(RSP)
+    assert s.renumber_questions(MAPPING) == MAPPING
+    v = s.ques_version()
+    assert s.renumber_questions(MAPPING) == {}   # phiên admin thứ 2 với ngân hàng cũ
+    assert qids(s)[:2] == (["1", "2", "3"], EXPECT) and s.ques_version() == v
+
+def test_stale_mapping_is_ignored_sheets():
+    fake, s = sheets_store()
+    assert s.renumber_questions(MAPPING) == MAPPING
+    assert s.renumber_questions(MAPPING) == {}
+    q, rsp, ans = qids(s)
+    assert q == ["1", "2", "3"] and rsp == EXPECT and sorted(ans) == sorted(EXPECT)
+
+def test_orphan_answer_replaces_older_orphan_sqlite(tmp_path):
+    s = app.SqlStorage(str(tmp_path / "t.db"))
+    for r in QUES: s.add_question(r)
+    # "x2" còn lại từ lần đánh số trước; câu 2 hiện tại lại bị xóa
+    s.save_user_states({"u@x.vn": ([["t0", "x2", "B", "False", "0"], ["t1", "2", "A", "True", "1"],
+                                    ["t1", "3", "A", "True", "1"]], 1)})
+    assert s.renumber_questions(MAPPING) == MAPPING
+    rows = {r[1]: r for r in s.user_state("u@x.vn")[1]}
+    assert sorted(rows) == ["2", "x2"] and rows["x2"][0] == "t1"
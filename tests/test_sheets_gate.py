@@ -0,0 +1,88 @@
+import threading
+import pytest
+import requests
+import app
+import fake_sheets
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff không ngủ thật; ghi lại cận trên (full jitter) và thời gian chờ đã chọn."""
+    got = []
+    monkeypatch.setattr(app.random, "uniform", lambda a, b: got.append((a, b)) or b)
+    monkeypatch.setattr(app.time, "sleep", lambda s: got.append(s))
+    return got
+
+def flaky(*errors):
+    """fn lần lượt ném các lỗi cho trước rồi trả "ok"; đếm số lần được gọi."""
+    n = [0]
+    def fn():
+        n[0] += 1
+        if n[0] <= len(errors): raise errors[n[0]-1]
+        return "ok"
+    return fn, n
+
+def metric(gate, op):
+    return next(r for r in gate.metrics.rows() if r["thao tác"] == op)
+
+@pytest.mark.parametrize("code", sorted(app.RETRY_CODES))
+def test_retries_quota_and_server_errors(code, sleeps):
+    gate = app.SheetsGate()
+    fn, n = flaky(fake_sheets.api_error(code, "x"), fake_sheets.api_error(code, "x"))
+    assert gate.call("op", True, None, fn) == "ok" and n[0] == 3
+    m = metric(gate, "op")
+    assert (m["lượt gọi"], m["thử lại"], m["lỗi"], m["bị 429"]) == (1, 2, 0, 2 if code == 429 else 0)
+
+def test_retries_network_errors(sleeps):
+    fn, n = flaky(requests.ConnectionError(), requests.Timeout())
+    assert app.SheetsGate().call("op", False, "k", fn) == "ok" and n[0] == 3
+
+@pytest.mark.parametrize("code", [400, 403, 404])
+def test_client_errors_are_not_retried(code, sleeps):
+    gate = app.SheetsGate()
+    fn, n = flaky(fake_sheets.api_error(code, "x"))
+    with pytest.raises(app.gspread.exceptions.APIError): gate.call("op", True, None, fn)
+    assert n[0] == 1 and sleeps == []
+    assert (metric(gate, "op")["thử lại"], metric(gate, "op")["lỗi"]) == (0, 1)
+
+def test_full_jitter_backoff_then_give_up(sleeps):
+    fake = fake_sheets.FakeSheets()
+    fake.seed("B", "S", [["a"]])
+    gate = app.SheetsGate()
+    ws = app.QuotaSheets(fake.client(), gate).open("B").worksheet("S")
+    fake.p429 = 1.0   # từ đây mọi lệnh gọi đều bị 429
+    with pytest.raises(app.gspread.exceptions.APIError): ws.get_all_values()
+    tries = app.SHEETS_TRIES
+    assert fake.calls["get_all_values"] == tries
+    # mỗi lần chờ chọn ngẫu nhiên trong [0, min(32, 2^i)], lần cuối không chờ mà báo lỗi
+    assert sleeps == [x for i in range(tries-1) for x in ((0, min(32, 2**i)), min(32, 2**i))]
+    m = metric(gate, "S.get_all_values")
+    assert (m["lượt gọi"], m["thử lại"], m["bị 429"], m["lỗi"]) == (1, tries-1, tries, 1)
+
+def test_concurrent_identical_reads_are_coalesced():
+    fake = fake_sheets.FakeSheets(latency=0.2)
+    fake.seed("B", "S", [["a", "b"], ["1", "2"]])
+    gate = app.SheetsGate()
+    ws = app.QuotaSheets(fake.client(), gate).open("B").worksheet("S")
+    fake.reset_stats()
+    out, go = [None]*5, threading.Barrier(5)
+    def read(i): go.wait(); out[i] = ws.get_all_values()
+    ts = [threading.Thread(target=read, args=(i,)) for i in range(5)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    assert fake.calls["get_all_values"] == 1
+    assert all(o == [["a", "b"], ["1", "2"]] for o in out)
+    out[0][0][0] = "z"; assert out[1][0][0] == "a"   # mỗi phiên một bản sao
+    m = metric(gate, "S.get_all_values")
+    assert (m["lượt gọi"], m["gộp"]) == (1, 4)
+
+def test_writes_and_different_reads_are_not_coalesced():
+    fake = fake_sheets.FakeSheets(latency=0.1)
+    fake.seed("B", "S", [["a"], ["1"]])
+    ws = app.QuotaSheets(fake.client(), app.SheetsGate()).open("B").worksheet("S")
+    fake.reset_stats()
+    jobs = [lambda: ws.append_row(["2"]), lambda: ws.append_row(["2"]),
+            lambda: ws.row_values(1), lambda: ws.row_values(2)]
+    ts = [threading.Thread(target=j) for j in jobs]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    assert (fake.calls["append_row"], fake.calls["row_values"]) == (2, 2)
@@ -0,0 +1,47 @@
+import random
+import app
+from conftest import bank
+
+def rsp(em, qid, sel, ok, sc, en=1):
+    return [em, qid, sel, ok, sc, "2026-01-01 00:00:00", str(en)]
+
+def setup(tmp_path):
+    s = app.SqlStorage(str(tmp_path / "t.db"))
+    sn = app.ResponseSnapshot(str(tmp_path / "snap"))
+    return s, sn, app.ResponseStats(sn)
+
+def test_stats_match_full_history(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "SNAP_ROWS", 100)
+    rnd = random.Random(1)
+    rows = [rsp(f"s{rnd.randint(0, 20)}@x", str(rnd.randint(1, 8)), rnd.choice(["A", "B", "A,B", ""]),
+                rnd.choice(["True", "False"]), rnd.choice(["1", "0"]), rnd.randint(1, 3))
+            for _ in range(700)]
+    s, sn, agg = setup(tmp_path)
+    s.append_responses(rows[:500]); agg.refresh(s, every=0)
+    assert sn.rows_count == 500
+    s.append_responses(rows[500:]); agg.refresh(s, every=0)
+    ref = app.ResponseStats(app.ResponseSnapshot(str(tmp_path / "empty")))
+    for r in rows: ref._fold(*r)
+    fresh = app.ResponseStats(sn); fresh.refresh(s, every=0)   # nạp lại từ ảnh chụp + phần đuôi
+    key = lambda df: df.sort_values("email").reset_index(drop=True)
+    for a in (agg, fresh):
+        assert key(a.students()).equals(key(ref.students()))
+        assert a.questions().equals(ref.questions())
+
+def test_archived_run_leaves_stats_and_is_never_regraded(tmp_path):
+    s, sn, agg = setup(tmp_path)
+    s.append_responses([rsp("old@x", "1", "A", "True", "1.0")])
+    assert sn.archive(s, "Run 1") == 1
+    assert s.responses().empty
+    s.append_responses([rsp("new@x", "1", "B", "True", "1.0")])
+    agg.reset(); agg.refresh(s, every=0)
+    assert agg.students().email.tolist() == ["new@x"]
+    assert list(agg.answers()) == ["new@x"]
+    # Đợt sau đổi đáp án câu 1: chỉ dòng của đợt hiện tại được chấm lại
+    sn.compact(s)
+    assert sn.regrade(bank(("1", "q", "A. a\nB. b", "B", "1"))) == 0
+    assert sn.regrade(bank(("1", "q", "A. a\nB. b", "A", "1"))) == 1
+    sn.remap({2: 1})
+    hist = {r[0]: r for r in sn.rows()}
+    assert hist["old@x"][1:5] == ("1", "A", True, 1.0) and hist["old@x"][7] == "Run 1"
+    assert hist["new@x"][1:5] == ("x1", "B", False, 0.0) and hist["new@x"][7] == ""